@@ -10,20 +10,13 @@ from src.constants import (
     EXTENSIONS_DOWNLOAD,
     EXTENSIONS_ALL,
 )
-from src.logger import setup_logging
 from src.menu import print_message
-from src.language import os_language, directories_name, messages, LANGUAGE_FUNCTIONS
-from src.utils import (
-    sort_directory,
-    clear_console,
-    ensure_extensions_file_exists,
-    modify_extensions,
-    ensure_folder_paths_file_exists,
-    modify_folder_paths,
-    load_folder_paths_from_file,
-    ensure_log_file_exists,
+from src.language import (
+    os_language,
+    directories_name,
+    messages,
+    get_language_functions,
 )
-from src.undo import undo_all_operations
 from colorama import Fore, Style
 import sys
 import subprocess
@@ -171,12 +164,24 @@ def update_program():
 
 
 def main():  # Main function that runs the program
+    # Imported here rather than at the top so the command line mode, which
+    # does not need them, starts quickly
+    from src.utils import (
+        sort_directory,
+        clear_console,
+        modify_extensions,
+        modify_folder_paths,
+        load_folder_paths_from_file,
+        get_sort_targets,
+    )
+    from src.pipeline import sort_all
+    from src.progress import SortProgress
+    from src.undo import undo_all_operations
+
     sorted_flag = False  # Flag to keep track if any file has been moved
     sorted_folders = set()  # Set to keep track of the sorted folders
     while True:
-        language_functions = LANGUAGE_FUNCTIONS.get(
-            os_language, LANGUAGE_FUNCTIONS["en"]
-        )
+        language_functions = get_language_functions(os_language)
         user_choice = input(language_functions["menu"])
         print(Fore.BLUE + "--" * 50 + Style.RESET_ALL)
         if user_choice not in MENU_CHOICE:
@@ -188,8 +193,11 @@ def main():  # Main function that runs the program
             print(Fore.BLUE + "-" * 100 + Style.RESET_ALL)
             continue
         if user_choice == "1":  # Sort music files
+            progress = SortProgress("Sorting")
             sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Music"], EXTENSIONS_MUSIC
+                Path.home() / directories_name["Music"],
+                EXTENSIONS_MUSIC,
+                progress=progress,
             )
             clear_console()
             sorted_folders.update(new_folders)
@@ -214,9 +222,14 @@ def main():  # Main function that runs the program
                     + "{}".format("No files were moved.".center(100))
                     + Style.RESET_ALL
                 )
+            if sorted_flag:
+                print(Fore.BLUE + progress.format_summary() + Style.RESET_ALL)
         elif user_choice == "2":  # Sort video files
+            progress = SortProgress("Sorting")
             sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Videos"], EXTENSIONS_VIDEO
+                Path.home() / directories_name["Videos"],
+                EXTENSIONS_VIDEO,
+                progress=progress,
             )
             clear_console()
             sorted_folders.update(new_folders)
@@ -241,9 +254,14 @@ def main():  # Main function that runs the program
                     + "{}".format("No files were moved.".center(100))
                     + Style.RESET_ALL
                 )
+            if sorted_flag:
+                print(Fore.BLUE + progress.format_summary() + Style.RESET_ALL)
         elif user_choice == "3":  # Sort image files
+            progress = SortProgress("Sorting")
             sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Images"], EXTENSIONS_IMAGE
+                Path.home() / directories_name["Images"],
+                EXTENSIONS_IMAGE,
+                progress=progress,
             )
             clear_console()
             sorted_folders.update(new_folders)
@@ -268,9 +286,14 @@ def main():  # Main function that runs the program
                     + "{}".format("No files were moved.".center(100))
                     + Style.RESET_ALL
                 )
+            if sorted_flag:
+                print(Fore.BLUE + progress.format_summary() + Style.RESET_ALL)
         elif user_choice == "4":  # Sort document files
+            progress = SortProgress("Sorting")
             sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Documents"], EXTENSIONS_DOCUMENT
+                Path.home() / directories_name["Documents"],
+                EXTENSIONS_DOCUMENT,
+                progress=progress,
             )
             clear_console()
             sorted_folders.update(new_folders)
@@ -295,9 +318,14 @@ def main():  # Main function that runs the program
                     + "{}".format("No files were moved.".center(100))
                     + Style.RESET_ALL
                 )
+            if sorted_flag:
+                print(Fore.BLUE + progress.format_summary() + Style.RESET_ALL)
         elif user_choice == "5":  # Sort download files
+            progress = SortProgress("Sorting")
             sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Downloads"], EXTENSIONS_DOWNLOAD
+                Path.home() / directories_name["Downloads"],
+                EXTENSIONS_DOWNLOAD,
+                progress=progress,
             )
             clear_console()
             sorted_folders.update(new_folders)
@@ -322,6 +350,8 @@ def main():  # Main function that runs the program
                     + "{}".format("No files were moved.".center(100))
                     + Style.RESET_ALL
                 )
+            if sorted_flag:
+                print(Fore.BLUE + progress.format_summary() + Style.RESET_ALL)
         elif user_choice == "6":  # Sort a specific folder
             try:
                 print(Fore.BLUE + "{}".format("-" * 100) + Style.RESET_ALL)
@@ -343,7 +373,10 @@ def main():  # Main function that runs the program
                     )
                     print(Fore.BLUE + "{}".format("-" * 100) + Style.RESET_ALL)
                     return
-                sorted_flag, new_folders = sort_directory(Custom_DIR, EXTENSIONS_ALL)
+                progress = SortProgress("Sorting")
+                sorted_flag, new_folders = sort_directory(
+                    Custom_DIR, EXTENSIONS_ALL, progress=progress
+                )
                 clear_console()
                 sorted_folders.update(new_folders)
                 if sorted_flag:  # Only print if any file has been moved
@@ -367,47 +400,17 @@ def main():  # Main function that runs the program
                         + "{}".format("No files were moved.".center(100))
                         + Style.RESET_ALL
                     )
+                if sorted_flag:
+                    print(Fore.BLUE + progress.format_summary() + Style.RESET_ALL)
             except Exception as e:
                 print(Fore.RED + f"An error occurred: {e}" + Style.RESET_ALL)
         elif user_choice == "7":  # Sort all the directories
-            sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Music"], EXTENSIONS_MUSIC
-            )
-            clear_console()
-            sorted_folders.update(new_folders)
-            sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Videos"], EXTENSIONS_VIDEO
-            )
-            clear_console()
-            sorted_folders.update(new_folders)
-            sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Images"], EXTENSIONS_IMAGE
-            )
-            clear_console()
-            sorted_folders.update(new_folders)
-            sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Downloads"], EXTENSIONS_DOWNLOAD
-            )
-            clear_console()
-            sorted_folders.update(new_folders)
-            sorted_flag, new_folders = sort_directory(
-                Path.home() / directories_name["Documents"], EXTENSIONS_DOCUMENT
-            )
-            clear_console()
-            sorted_folders.update(new_folders)
-            folder_paths = load_folder_paths_from_file()
-            try:
-                folder_name, folder_path = next(iter(folder_paths.items()))
-            except StopIteration:
-                print("No custom folders to sort.")
-            else:
-                for folder_name, folder_path in folder_paths.items():
-                    if Path(folder_path).is_dir():
-                        sorted_flag, new_folders = sort_directory(
-                            Path(folder_path), EXTENSIONS_ALL
-                        )
-                        clear_console()
-                        sorted_folders.update(new_folders)
+            # Every directory is sorted concurrently, device by device
+            progress = SortProgress("Sorting")
+            report = sort_all(get_sort_targets(), progress=progress)
+            progress.close()
+            sorted_folders.update(report["sorted_folders"])
+            sorted_flag = report["moved"] > 0
             if sorted_flag:  # Only print if any file has been moved
                 clear_console()
                 for folder in sorted_folders:
@@ -431,6 +434,16 @@ def main():  # Main function that runs the program
                     + "{}".format("No files were moved.".center(100))
                     + Style.RESET_ALL
                 )
+            for directory, error in report["errors"].items():
+                print(Fore.RED + f"{directory}: {error}" + Style.RESET_ALL)
+            if not load_folder_paths_from_file():
+                print("No custom folders to sort.")
+            print(
+                Fore.BLUE
+                + f"{report['moved']} entries moved from {report['directories']} "
+                f"directories on {report['devices']} devices "
+                f"in {report['seconds']} s" + Style.RESET_ALL
+            )
         elif user_choice == "8":  # Add a folder to the sorting program
             clear_console()
             modify_folder_paths()
@@ -508,13 +521,27 @@ def main():  # Main function that runs the program
             print(Fore.BLUE + "-" * 100 + Style.RESET_ALL)
             sys.exit()
 
+
 def launch_program():
+    from src.logger import setup_logging
+    from src.instrument import enable_from_environment
+    from src.utils import (
+        ensure_extensions_file_exists,
+        ensure_folder_paths_file_exists,
+        ensure_log_file_exists,
+    )
+
     ensure_log_file_exists()
     setup_logging()
+    enable_from_environment()  # Reports are written when the program exits
     ensure_extensions_file_exists()
     ensure_folder_paths_file_exists()
     main()
 
 
 if __name__ == "__main__":  # Run the main function
+    if len(sys.argv) > 1:  # Command line mode, see src/cli.py
+        from src.cli import run_cli
+
+        sys.exit(run_cli(sys.argv[1:]))
     update_program()
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+"""Time file name classification with the compiled classifier.
+
+Usage: python benchmarks/bench_classifier.py [--lookups 10000000]
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.classifier import ExtensionClassifier  # noqa: E402
+from src.constants import EXTENSIONS_ALL  # noqa: E402
+
+
+def sample_names(count):
+    # A mix of known, upper case, compound, unknown and extensionless names
+    suffixes = sorted(EXTENSIONS_ALL) + [".JPG", ".tar.gz", ".unknown", "", ".2024.pdf"]
+    return [f"file_{i}{suffixes[i % len(suffixes)]}" for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    names = sample_names(10_000)
+    repeat = max(1, args.lookups // len(names))
+    lookups = repeat * len(names)
+    classifier = ExtensionClassifier(EXTENSIONS_ALL)
+    classify = classifier.classify
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name in names:
+            EXTENSIONS_ALL.get(os.path.splitext(name)[1].lower(), "Divers")
+    dict_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name in names:
+            classify(name)
+    classifier_time = time.perf_counter() - start
+
+    for label, elapsed in (
+        ("splitext + dict.get", dict_time),
+        ("ExtensionClassifier", classifier_time),
+    ):
+        print(
+            f"{label:<20} {lookups} lookups in {elapsed:7.2f}s "
+            f"({elapsed / lookups * 1e9:6.0f} ns/lookup)"
+        )
+
+
+if __name__ == "__main__":
+    main()
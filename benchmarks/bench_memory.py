@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""Measure the memory held per planned move by each representation.
+
+Usage: python benchmarks/bench_memory.py [--moves 1000000]
+
+"Path triples" is what execute_plan used to keep for every move (source,
+destination and original location as Path objects); "PlannedMove tuple" is
+a plan holding full path strings; "MoveRecords" is the compact store plans
+now use, with the positions execute_plan keeps while moving.
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.classifier import get_classifier  # noqa: E402
+from src.constants import EXTENSIONS_ALL  # noqa: E402
+from src.records import MoveRecords, PlannedMove  # noqa: E402
+from synthetic import extension_weights  # noqa: E402
+
+DIRECTORY = os.path.join(os.path.expanduser("~"), "Downloads")
+ORIGIN = os.path.realpath(DIRECTORY)
+
+
+def planned_moves(count):
+    # Fresh strings for every move, as when they come from os.scandir
+    classifier = get_classifier(EXTENSIONS_ALL)
+    suffixes, _ = extension_weights()
+    for i in range(count):
+        name = f"file_{i:07d}{suffixes[i % len(suffixes)]}"
+        category = classifier.match(name)[1] or classifier.default
+        yield PlannedMove(
+            os.path.join(DIRECTORY, name),
+            os.path.join(DIRECTORY, category, name),
+            i % 100_000,
+            category,
+            "file",
+        )
+
+
+def path_triples(count):
+    return [
+        (
+            Path(move.source),
+            Path(move.destination),
+            Path(ORIGIN) / os.path.relpath(move.source, DIRECTORY),
+        )
+        for move in planned_moves(count)
+    ]
+
+
+def planned_tuple(count):
+    return tuple(planned_moves(count))
+
+
+def move_records(count):
+    records = MoveRecords(planned_moves(count))
+    return records, records.ordered()
+
+
+def measure(build, count):
+    tracemalloc.start()
+    kept = build(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--moves", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"{'representation':<20} {'MiB':>10} {'bytes/move':>11}")
+    for label, build in (
+        ("Path triples", path_triples),
+        ("PlannedMove tuple", planned_tuple),
+        ("MoveRecords", move_records),
+    ):
+        size = measure(build, args.moves)
+        print(f"{label:<20} {size / 2**20:>10.1f} {size / args.moves:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
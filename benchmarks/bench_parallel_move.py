@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+"""Compare sequential and thread-pool moves in sort_directory.
+
+Usage: python benchmarks/bench_parallel_move.py [--sizes 10000 100000 1000000]
+       [--workers 1 4 16] [--root /dev/shm]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.constants import EXTENSIONS_ALL  # noqa: E402
+from src.shared import undo_stack  # noqa: E402
+from src.utils import sort_directory  # noqa: E402
+
+EXTENSIONS = sorted(EXTENSIONS_ALL) + [".unknown"]
+
+
+def populate(directory, count):
+    for i in range(count):
+        (directory / f"file_{i}{EXTENSIONS[i % len(EXTENSIONS)]}").touch()
+
+
+def run(count, workers, root):
+    with tempfile.TemporaryDirectory(dir=root) as tmp:
+        directory = Path(tmp)
+        populate(directory, count)
+        undo_stack.clear()
+        start = time.perf_counter()
+        sort_directory(directory, EXTENSIONS_ALL, workers=workers)
+        elapsed = time.perf_counter() - start
+        moved = len(undo_stack)
+        undo_stack.clear()
+    return elapsed, moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--root", default=None, help="Where to create the trees")
+    args = parser.parse_args()
+
+    print(f"{'files':>10} {'workers':>8} {'seconds':>10} {'files/s':>12}")
+    # Work in a throwaway directory, so that the journal, index and run
+    # report under User_Files/ are not the real ones
+    with tempfile.TemporaryDirectory(dir=args.root) as workspace:
+        os.chdir(workspace)
+        try:
+            for count in args.sizes:
+                for workers in args.workers:
+                    elapsed, moved = run(count, workers, workspace)
+                    print(
+                        f"{count:>10} {workers:>8} {elapsed:>10.2f} "
+                        f"{moved / elapsed:>12.0f}"
+                    )
+        finally:
+            undo_stack.clear()  # Also closes the journal file
+            os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
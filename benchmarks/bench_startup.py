@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+"""Measure the start-up cost of the language tables and of the CLI.
+
+Usage: python benchmarks/bench_startup.py [--runs 20]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.language import LANGUAGE_SETTINGS, LanguageFunctions, os_language  # noqa: E402
+
+
+def time_tables(runs):
+    # Eager: what importing src.language used to do, every language built
+    eager, lazy = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        tables = LanguageFunctions()
+        for language in LANGUAGE_SETTINGS:
+            tables[language]
+        eager.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        LanguageFunctions().get(os_language)
+        lazy.append(time.perf_counter() - start)
+    return statistics.median(eager), statistics.median(lazy)
+
+
+def time_command(command, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    eager, lazy = time_tables(args.runs)
+    print(f"{'language tables, all languages':<31}: {eager * 1000:8.3f} ms")
+    print(f"{'language tables, ' + os_language + ' only':<31}: {lazy * 1000:8.3f} ms")
+    for name, command in (
+        ("python -c pass", [sys.executable, "-c", "pass"]),
+        ("import src.language", [sys.executable, "-c", "import src.language"]),
+        ("GlobalSort.py --help", [sys.executable, "GlobalSort.py", "--help"]),
+    ):
+        print(f"{name:<31}: {time_command(command, args.runs) * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
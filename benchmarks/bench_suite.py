@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+"""Sort, classify and undo synthetic trees and record the results as JSON.
+
+Usage: python benchmarks/bench_suite.py [--files 1000000] [--root /dev/shm]
+       [--output results.json] [--baseline previous.json]
+
+Each scenario runs in a fresh process whose working directory is a
+temporary folder, so the journal, caches and index of the user are left
+alone and the peak RSS of one scenario does not leak into the next one.
+With --baseline, steps slower than the baseline by more than --tolerance
+are reported and the exit code is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.constants import EXTENSIONS_ALL  # noqa: E402
+from src.shared import fs_calls, undo_stack  # noqa: E402
+from src.undo import undo_all_operations  # noqa: E402
+from src.utils import get_folder_category, sort_directory  # noqa: E402
+from synthetic import MIXES, make_flat_tree, make_nested_tree  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_kib():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # Bytes on macOS
+
+
+def measure(step, items, function, *args, **kwargs):
+    fs_calls.clear()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    return {
+        "step": step,
+        "items": items,
+        "seconds": round(seconds, 4),
+        "items_per_second": round(items / seconds) if seconds > 0 else None,
+        "fs_calls": sum(fs_calls.values()),
+        "fs_call_details": dict(sorted(fs_calls.items())),
+        "peak_rss_kib": peak_rss_kib(),
+    }
+
+
+def run_flat(workspace, options):
+    directory = Path(workspace, "home")
+    count = make_flat_tree(directory, options["files"], options["seed"], options["mix"])
+    sort = dict(workers=options["workers"], use_folder_cache=False)
+    return [
+        measure("sort", count, sort_directory, directory, EXTENSIONS_ALL, **sort),
+        # Nothing arrived since the sort: answered by the incremental index
+        measure("resort", count, sort_directory, directory, EXTENSIONS_ALL, **sort),
+        measure("undo", count, undo_all_operations),
+    ]
+
+
+def run_nested(workspace, options):
+    directory = Path(workspace, "home")
+    count = make_nested_tree(
+        directory,
+        options["folders"],
+        options["depth"],
+        options["files_per_folder"],
+        options["seed"],
+        options["mix"],
+    )
+    folders = sorted(directory.iterdir())
+
+    def categories():
+        for folder in folders:
+            get_folder_category(folder, EXTENSIONS_ALL)
+
+    sort = dict(workers=options["workers"], use_folder_cache=False)
+    return [
+        measure("folder_category", count, categories),
+        measure(
+            "sort", len(folders), sort_directory, directory, EXTENSIONS_ALL, **sort
+        ),
+        measure("undo", len(folders), undo_all_operations),
+    ]
+
+
+SCENARIOS = {"flat": run_flat, "nested": run_nested}
+
+
+def run_scenario(name, options):
+    # Child process side: work in a throwaway directory, relative paths
+    # such as User_Files/ included
+    with tempfile.TemporaryDirectory(dir=options["root"]) as workspace:
+        os.chdir(workspace)
+        undo_stack.clear()
+        try:
+            return SCENARIOS[name](workspace, options)
+        finally:
+            undo_stack.clear()  # Also closes the journal file
+            os.chdir(ROOT)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    # Return the (scenario, step, ratio) of the steps that got slower
+    previous = {
+        (scenario, step["step"]): step["seconds"]
+        for scenario, data in baseline["scenarios"].items()
+        for step in data["steps"]
+    }
+    slower = []
+    for scenario, data in results["scenarios"].items():
+        for step in data["steps"]:
+            before = previous.get((scenario, step["step"]))
+            if before and step["seconds"] > before * (1 + tolerance):
+                slower.append((scenario, step["step"], step["seconds"] / before))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--files", type=int, default=100_000, help="Files of the flat tree"
+    )
+    parser.add_argument("--folders", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--files-per-folder", type=int, default=20)
+    parser.add_argument("--mix", choices=MIXES, default="extensions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--root", default=None, help="Where to create the trees")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    options = {
+        "files": args.files,
+        "folders": args.folders,
+        "depth": args.depth,
+        "files_per_folder": args.files_per_folder,
+        "mix": args.mix,
+        "seed": args.seed,
+        "workers": args.workers,
+        "root": args.root,
+    }
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+        "scenarios": {},
+    }
+    print(
+        f"{'scenario':<10} {'step':<16} {'items':>9} {'seconds':>9} "
+        f"{'items/s':>10} {'fs calls':>9} {'peak RSS':>10}"
+    )
+    for name in args.scenarios:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            steps = executor.submit(run_scenario, name, options).result()
+        results["scenarios"][name] = {"steps": steps}
+        for step in steps:
+            rss = step["peak_rss_kib"]
+            print(
+                f"{name:<10} {step['step']:<16} {step['items']:>9} "
+                f"{step['seconds']:>9.3f} {step['items_per_second'] or 0:>10} {step['fs_calls']:>9} "
+                f"{'-' if rss is None else f'{rss // 1024} MiB':>10}"
+            )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for scenario, step, ratio in slower:
+            print(f"Regression: {scenario}/{step} is {ratio:.2f}x slower than before")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
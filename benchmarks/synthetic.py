@@ -0,0 +1,102 @@
+"""Reproducible synthetic home directories for the benchmarks.
+
+The same seed always gives the same names, extensions and layout, so runs
+on different commits sort exactly the same trees.
+"""
+
+import os
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.constants import EXTENSIONS_ALL  # noqa: E402
+
+MIXES = ("extensions", "categories")
+UNKNOWN_EXTENSIONS = (".unknown", ".bak", ".dat", "")  # Sorted into "Divers"
+
+
+def extension_weights(mix="extensions", unknown=0.05, extensions=EXTENSIONS_ALL):
+    """Return (suffixes, weights) to draw file extensions from.
+
+    "extensions" gives every extension of the map the same weight, so the
+    categories are as frequent as they are in the map; "categories" gives
+    every category the same weight. ``unknown`` is the share of names with
+    an extension the map does not know, or none at all.
+    """
+    if mix not in MIXES:
+        raise ValueError(f"Unknown mix: {mix}")
+    suffixes = sorted(extensions)
+    if mix == "extensions":
+        weights = [1.0] * len(suffixes)
+    else:
+        per_category = {}
+        for suffix in suffixes:
+            per_category[extensions[suffix]] = (
+                per_category.get(extensions[suffix], 0) + 1
+            )
+        weights = [1.0 / per_category[extensions[suffix]] for suffix in suffixes]
+    known = sum(weights)
+    weights = [weight * (1 - unknown) / known for weight in weights]
+    suffixes += UNKNOWN_EXTENSIONS
+    weights += [unknown / len(UNKNOWN_EXTENSIONS)] * len(UNKNOWN_EXTENSIONS)
+    return suffixes, weights
+
+
+def _create(path, size):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if size:
+            os.write(fd, os.urandom(size))
+    finally:
+        os.close(fd)
+
+
+def make_flat_tree(directory, files, seed=0, mix="extensions", unknown=0.05, size=0):
+    """Create files with random extensions directly in directory.
+
+    Returns the number of files created. ``size`` bytes of random data are
+    written to each file; 0 keeps them empty and the tree cheap to build.
+    """
+    rng = random.Random(seed)
+    suffixes, weights = extension_weights(mix, unknown)
+    os.makedirs(directory, exist_ok=True)
+    for i, suffix in enumerate(rng.choices(suffixes, weights, k=files)):
+        _create(os.path.join(directory, f"file_{i:07d}{suffix}"), size)
+    return files
+
+
+def make_nested_tree(
+    directory,
+    folders,
+    depth,
+    files_per_folder,
+    seed=0,
+    mix="extensions",
+    unknown=0.05,
+):
+    """Create folders top-level folders, each nested depth levels deep.
+
+    Every level holds files_per_folder files. Each top-level folder leans
+    towards one extension, like an album or a photo import, so that
+    get_folder_category has a majority to find. Returns the number of files.
+    """
+    rng = random.Random(seed)
+    suffixes, weights = extension_weights(mix, unknown)
+    created = 0
+    for i in range(folders):
+        favourite = rng.choices(suffixes, weights)[0]
+        level = os.path.join(directory, f"folder_{i:05d}")
+        for d in range(depth + 1):
+            os.makedirs(level, exist_ok=True)
+            for j in range(files_per_folder):
+                suffix = (
+                    favourite
+                    if rng.random() < 0.7
+                    else rng.choices(suffixes, weights)[0]
+                )
+                _create(os.path.join(level, f"item_{j:05d}{suffix}"), 0)
+                created += 1
+            level = os.path.join(level, f"level_{d + 1}")
+    return created
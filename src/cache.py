@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from .logger import log_message
+from .shared import count_fs_call
+
+FOLDER_CACHE_FILE = "User_Files/folder_cache.json"
+FOLDER_CACHE_MAX_ENTRIES = 2000  # Least recently used folders are evicted first
+FOLDER_CACHE_MAX_DIRS = 5000  # Larger trees are cheaper to walk than to validate
+# Directories modified this recently may change again within the same mtime
+# tick (FAT has a 2 second resolution), so they are not cached yet
+FOLDER_CACHE_RACY_SECONDS = 2
+
+
+class FolderCategoryCache:
+    """On-disk cache of the extension counts of folders.
+
+    Entries are keyed by folder path and remember the inode of the folder and
+    the mtime of every directory in its tree. Adding, removing or renaming a
+    file changes the mtime of its directory, so a tree whose directories all
+    kept their mtime still has the same extension counts and its walk can be
+    skipped. Counts are stored per extension so that editing the extension
+    maps does not invalidate the cache.
+    """
+
+    def __init__(self, path=FOLDER_CACHE_FILE, max_entries=FOLDER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self.dirty = False
+        self._lock = threading.Lock()  # Directories may be sorted concurrently
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.entries = OrderedDict(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            log_message("warning", f"Ignoring unreadable folder cache: {e}")
+
+    def save(self):
+        with self._lock:
+            if self.dirty:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "w") as f:
+                    json.dump(self.entries, f)
+                self.dirty = False
+        log_message(
+            "info",
+            f"Folder cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions, {len(self.entries)} entries",
+        )
+
+    def lookup(self, folder_path, signature=""):
+        """Return the cached extension counts of folder_path, or None.
+
+        signature identifies the compound extensions of the classifier; the
+        counts are keyed by them, so a different set means a miss.
+        """
+        key = os.path.abspath(folder_path)
+        entry = self.entries.get(key)
+        valid = (
+            entry is not None
+            and entry.get("signature", "") == signature
+            and self._is_valid(key, entry)
+        )
+        with self._lock:
+            if valid:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry["counts"]
+            if self.entries.pop(key, None) is not None:
+                self.dirty = True
+            self.misses += 1
+        return None
+
+    def store(self, folder_path, inode, directories, counts, signature=""):
+        """Remember the counts of a fully walked folder.
+
+        ``directories`` maps each directory of the tree, relative to
+        folder_path, to its st_mtime_ns at the time of the walk.
+        """
+        if len(directories) > FOLDER_CACHE_MAX_DIRS:
+            return
+        racy_limit = time.time_ns() - FOLDER_CACHE_RACY_SECONDS * 1_000_000_000
+        if max(directories.values()) > racy_limit:
+            return
+        key = os.path.abspath(folder_path)
+        with self._lock:
+            self.entries[key] = {
+                "inode": inode,
+                "dirs": directories,
+                "counts": counts,
+                "signature": signature,
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.dirty = True
+
+    @staticmethod
+    def _is_valid(key, entry):
+        try:
+            for relative, mtime in entry["dirs"].items():
+                count_fs_call("stat")
+                stat = os.stat(os.path.join(key, relative))
+                if stat.st_mtime_ns != mtime:
+                    return False
+                if relative == "." and stat.st_ino != entry["inode"]:
+                    return False
+        except OSError:
+            return False
+        return True
+
+
+_folder_cache = None
+_folder_cache_lock = threading.Lock()
+
+
+def get_folder_cache():  # Load the persistent cache on first use
+    global _folder_cache
+    with _folder_cache_lock:
+        if _folder_cache is None:
+            _folder_cache = FolderCategoryCache(FOLDER_CACHE_FILE)
+    return _folder_cache
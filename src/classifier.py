@@ -0,0 +1,119 @@
+import fnmatch
+import re
+from types import MappingProxyType
+
+
+class ExtensionClassifier:
+    """Map file names to categories with a frozen, normalized extension table.
+
+    Extensions are lowercased and may be compound (".tar.gz"); the longest
+    known suffix of a name wins, so "backup.tar.gz" matches ".tar.gz" before
+    ".gz". Optional rules, given as (pattern, category) pairs, are tried on
+    the lowercased name when no extension matches. A pattern is a glob
+    ("*.part*") unless it starts with "re:", in which case it is a regular
+    expression.
+    """
+
+    __slots__ = (
+        "table",
+        "rules",
+        "default",
+        "reverse",
+        "max_dots",
+        "signature",
+        "_compound_tails",
+    )
+
+    def __init__(self, extensions, rules=(), default="Divers"):
+        table = {}
+        for ext, category in extensions.items():
+            ext = ext.strip().lower()
+            if ext and not ext.startswith("."):
+                ext = "." + ext
+            table[ext] = category
+        self.table = MappingProxyType(table)
+        self.rules = tuple(
+            (_compile_rule(pattern), category) for pattern, category in rules
+        )
+        self.default = default
+        # Deepest compound extension, e.g. 2 for ".tar.gz"
+        self.max_dots = max((ext.count(".") for ext in table), default=1)
+        reverse = {}
+        for ext, category in table.items():
+            reverse.setdefault(category, []).append(ext)
+        self.reverse = MappingProxyType(
+            {category: tuple(sorted(exts)) for category, exts in reverse.items()}
+        )
+        compound = sorted(ext for ext in table if ext.count(".") > 1)
+        # Last parts of the compound extensions (".gz" for ".tar.gz"): only
+        # names ending with one of them need a longer suffix lookup
+        self._compound_tails = frozenset(
+            "." + ext.rsplit(".", 1)[1] for ext in compound
+        )
+        # Identifies the compound extensions, which change how names are keyed
+        self.signature = ",".join(compound)
+
+    def match(self, name):
+        """Return (key, category) for name, category being None if unknown.
+
+        key is the matching table entry, or the plain extension of the name
+        when nothing in the table matches.
+        """
+        lowered = name.lower().rstrip()
+        dot = lowered.rfind(".")
+        # Leading dots belong to the name, as with os.path.splitext
+        if dot <= 0 or (lowered[0] == "." and not lowered[:dot].lstrip(".")):
+            key = ""
+        else:
+            key = lowered[dot:]
+            if key in self._compound_tails:
+                key = self._longest_suffix(lowered, dot, key)
+        category = self.table.get(key)
+        if category is None and self.rules:
+            for regex, rule_category in self.rules:
+                if regex.match(lowered):
+                    return key, rule_category
+        return key, category
+
+    def _longest_suffix(self, lowered, dot, key):
+        first = len(lowered) - len(lowered.lstrip(".")) + 1
+        for _ in range(self.max_dots - 1):
+            dot = lowered.rfind(".", first, dot)
+            if dot < 0:
+                break
+            if lowered[dot:] in self.table:
+                key = lowered[dot:]
+        return key
+
+    def classify(self, name):
+        category = self.match(name)[1]
+        return self.default if category is None else category
+
+    def extensions_of(self, category):
+        return self.reverse.get(category, ())
+
+
+def _compile_rule(pattern):
+    if pattern.startswith("re:"):
+        return re.compile(pattern[3:], re.IGNORECASE)
+    return re.compile(fnmatch.translate(pattern.lower()))
+
+
+_classifiers = {}  # Classifiers already built, by extension map contents
+
+
+def get_classifier(extensions):
+    """Return the classifier of an extension map, building it only once.
+
+    Classifiers are passed through unchanged. The maps are edited in place
+    from the menu, so they are looked up by content rather than identity.
+    """
+    if isinstance(extensions, ExtensionClassifier):
+        return extensions
+    key = tuple(extensions.items())
+    classifier = _classifiers.get(key)
+    if classifier is None:
+        if len(_classifiers) >= 32:
+            _classifiers.clear()
+        classifier = _classifiers[key] = ExtensionClassifier(extensions)
+    return classifier
@@ -0,0 +1,526 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from pathlib import Path
+from .constants import (
+    EXTENSIONS_MUSIC,
+    EXTENSIONS_VIDEO,
+    EXTENSIONS_IMAGE,
+    EXTENSIONS_DOCUMENT,
+    EXTENSIONS_DOWNLOAD,
+    EXTENSIONS_ALL,
+    LOG_FORMATS,
+    LOG_FORMAT_ENV,
+    PROFILE_ENV,
+    PROFILE_MODES,
+    DEDUP_POLICIES,
+    PIPELINE_CONCURRENCY,
+    PIPELINE_DEVICE_CONCURRENCY,
+    DEEP_SORT_DEPTH,
+    WATCH_SETTLE_SECONDS,
+    WATCH_POLL_SECONDS,
+)
+from .shared import count_fs_call, fs_calls
+from .classifier import get_classifier
+from .collisions import COLLISION_POLICIES
+
+# The modules doing the work (asyncio, sqlite3, logging) are imported by the
+# command that needs them, so that --help and argument errors stay instant
+
+EXTENSION_MAPS = {  # Extension maps selectable from the command line
+    "music": EXTENSIONS_MUSIC,
+    "video": EXTENSIONS_VIDEO,
+    "image": EXTENSIONS_IMAGE,
+    "document": EXTENSIONS_DOCUMENT,
+    "download": EXTENSIONS_DOWNLOAD,
+    "all": EXTENSIONS_ALL,
+}
+
+
+def load_extension_map(name):
+    """Return a named extension map, or load one from a JSON file."""
+    if name in EXTENSION_MAPS:
+        return EXTENSION_MAPS[name]
+    try:
+        with open(name, "r") as f:
+            extensions = json.load(f)
+    except (OSError, ValueError) as e:
+        raise argparse.ArgumentTypeError(f"cannot load extension map {name}: {e}")
+    return {ext.lower(): category for ext, category in extensions.items()}
+
+
+def profile_modes(value):
+    from .instrument import parse_modes
+
+    try:
+        return parse_modes(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="GlobalSort.py",
+        description="Sort files into category folders. "
+        "Without arguments the interactive menu is started.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=profile_modes,
+        metavar="MODES",
+        help="instrument the run and write reports to User_Files/: "
+        + ", ".join(PROFILE_MODES)
+        + ", comma separated (also read from "
+        + PROFILE_ENV
+        + ")",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        help="write User_Files/file_sorter.log as text, or "
+        "User_Files/file_sorter.jsonl as JSON lines (also read from "
+        + LOG_FORMAT_ENV
+        + ")",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Options shared by the commands that classify directories
+    classify = argparse.ArgumentParser(add_help=False)
+    classify.add_argument(
+        "-e",
+        "--extensions",
+        action="append",
+        type=load_extension_map,
+        metavar="MAP",
+        help="extension map: one of "
+        + ", ".join(sorted(EXTENSION_MAPS))
+        + " or a JSON file; repeat to merge several maps (default: all)",
+    )
+    classify.add_argument(
+        "--max-files",
+        type=int,
+        help="look at no more than this many files to classify a folder",
+    )
+    classify.add_argument(
+        "--max-depth",
+        type=int,
+        help="how many levels below a folder are looked at to classify it",
+    )
+    classify.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not use the folder category cache",
+    )
+    classify.add_argument(
+        "--sniff",
+        action="store_true",
+        help="classify files with an unknown extension from their content",
+    )
+    classify.add_argument(
+        "--on-collision",
+        choices=COLLISION_POLICIES,
+        default="rename",
+        help="what to do when a name is already taken in a target folder: "
+        'add a counter ("name (1).ext", the default), skip the entry, or '
+        "overwrite files older than the source",
+    )
+    moving = argparse.ArgumentParser(add_help=False)
+    moving.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of threads moving files (default: 1)",
+    )
+    moving.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=PIPELINE_CONCURRENCY,
+        help="directories processed at the same time, and the limit of "
+        f"filesystem calls in flight over all of them (default: {PIPELINE_CONCURRENCY})",
+    )
+    moving.add_argument(
+        "--per-device",
+        type=int,
+        help="filesystem calls in flight on one device, moves included, so "
+        "it also caps --workers; use 1 for hard disks "
+        f"(default: {PIPELINE_DEVICE_CONCURRENCY}, or --workers when higher)",
+    )
+    moving.add_argument(
+        "--full",
+        action="store_true",
+        help="look at every entry again, even those left as they were by "
+        "the last sort",
+    )
+    moving.add_argument(
+        "--dedup",
+        choices=DEDUP_POLICIES,
+        help="detect files whose content is already sorted or planned and "
+        "skip them, replace them by hard links or move them to a "
+        "duplicates folder",
+    )
+    moving.add_argument(
+        "--progress",
+        choices=("none", "bar", "json"),
+        default="none",
+        help="report the progress of the moves on stderr as a bar or as " "JSON lines",
+    )
+
+    # Recursive mode of sort and plan
+    deep = argparse.ArgumentParser(add_help=False)
+    deep.add_argument(
+        "--deep",
+        action="store_true",
+        help="move the files of subfolders one by one, down to --depth levels, "
+        "instead of moving whole folders; every entry is looked at, as with --full",
+    )
+    deep.add_argument(
+        "--depth",
+        type=int,
+        default=DEEP_SORT_DEPTH,
+        metavar="N",
+        help=f"levels of subfolders sorted in deep mode (default: {DEEP_SORT_DEPTH})",
+    )
+    deep.add_argument(
+        "--processes",
+        type=int,
+        help="processes walking the subfolders in deep mode (default: one per CPU)",
+    )
+
+    sort = commands.add_parser(
+        "sort", parents=[classify, moving, deep], help="sort one or more directories"
+    )
+    sort.add_argument("directories", nargs="+", type=Path, metavar="DIRECTORY")
+    sort.add_argument(
+        "--dry-run", action="store_true", help="only report what would be moved"
+    )
+
+    sort_all = commands.add_parser(
+        "sort-all",
+        parents=[classify, moving],
+        help="sort the home directories and the registered custom folders",
+    )
+    sort_all.add_argument(
+        "--dry-run", action="store_true", help="only report what would be moved"
+    )
+
+    plan = commands.add_parser(
+        "plan", parents=[classify, deep], help="print the moves a sort would make"
+    )
+    plan.add_argument("directory", type=Path)
+    plan.add_argument(
+        "--export",
+        metavar="FILE",
+        help="write the plan to FILE as JSON lines instead of printing it",
+    )
+
+    stats = commands.add_parser(
+        "stats",
+        parents=[classify],
+        help="count the files and bytes per category, sorted or not",
+    )
+    stats.add_argument("directories", nargs="+", type=Path, metavar="DIRECTORY")
+
+    watch = commands.add_parser(
+        "watch",
+        parents=[classify, moving],
+        help="sort new entries as they arrive, until interrupted",
+    )
+    watch.add_argument(
+        "directories",
+        nargs="*",
+        type=Path,
+        metavar="DIRECTORY",
+        help="directories to watch (default: the ones of sort-all)",
+    )
+    watch.add_argument(
+        "--settle",
+        type=float,
+        default=WATCH_SETTLE_SECONDS,
+        help="seconds an entry must stay unchanged before it is moved "
+        f"(default: {WATCH_SETTLE_SECONDS})",
+    )
+    watch.add_argument(
+        "--poll-interval",
+        type=float,
+        default=WATCH_POLL_SECONDS,
+        help=f"seconds between two scans when polling (default: {WATCH_POLL_SECONDS})",
+    )
+    watch.add_argument(
+        "--polling",
+        action="store_true",
+        help="poll the directories even where inotify is available",
+    )
+
+    commands.add_parser("undo", help="undo the moves of the last sorting session")
+    return parser
+
+
+def _extensions(args):
+    # Later maps override earlier ones for the same extension
+    extensions = {}
+    for extension_map in args.extensions or [EXTENSIONS_ALL]:
+        extensions.update(extension_map)
+    return extensions
+
+
+def _folder_budget(args):
+    return {"max_files": args.max_files, "max_depth": args.max_depth}
+
+
+def _progress(args):
+    from .progress import SortProgress
+
+    return SortProgress(
+        "Sorting",
+        live=args.progress != "none",
+        json_lines=args.progress == "json",
+        stream=sys.stderr,
+    )
+
+
+def _sort_targets(targets, args, progress):
+    from .pipeline import sort_targets
+
+    per_device = args.per_device
+    if per_device is None:  # Room on each device for all the move threads
+        per_device = max(PIPELINE_DEVICE_CONCURRENCY, args.workers)
+    return sort_targets(
+        targets,
+        progress=progress,
+        concurrency=args.concurrency,
+        incremental=not args.full,
+        per_device=per_device,
+        workers=args.workers,
+        dry_run=args.dry_run,
+        dedup=args.dedup,
+        folder_budget=_folder_budget(args),
+        use_folder_cache=not args.no_cache,
+        sniff=args.sniff,
+        collisions=args.on_collision,
+    )
+
+
+def _deep_sort(directory, args, progress):
+    from .deepsort import build_deep_plan, deep_sort
+    from .dedup import dedup_plan
+
+    result = {"directory": str(directory)}
+    if not directory.is_dir():
+        result["error"] = "directory does not exist"
+        return result
+    options = {
+        "max_depth": args.depth,
+        "processes": args.processes,
+        "sniff": args.sniff,
+        "collisions": args.on_collision,
+    }
+    if args.dry_run:
+        plan = build_deep_plan(directory, _extensions(args), **options)
+        if args.dedup is not None:
+            plan, _ = dedup_plan(plan, args.dedup)
+        result["planned"], result["moved"] = len(plan.moves), 0
+    else:
+        result["moved"], sorted_folders = deep_sort(
+            directory,
+            _extensions(args),
+            args.workers,
+            progress,
+            args.dedup,
+            **options,
+        )
+        result["sorted_folders"] = sorted(sorted_folders)
+    return result
+
+
+def _undo():
+    from .undo import undo_latest_session
+
+    result = undo_latest_session()
+    if result["failed"]:
+        result["error"] = "some moves could not be undone"
+    return result
+
+
+def _summary(command, results, start):
+    return {
+        "command": command,
+        "ok": not any("error" in result for result in results),
+        "seconds": round(time.perf_counter() - start, 3),
+        "moved": sum(result.get("moved", 0) for result in results),
+        "fs_calls": sum(fs_calls.values()),
+        "results": results,
+    }
+
+
+def _stats(directory, args):
+    # Count every file under directory, sorted or not, by the category it
+    # belongs to; folders are walked rather than counted as entries
+    from .sniffer import get_sniffer
+    from .utils import _walk_tree
+
+    if not directory.is_dir():
+        return {"directory": str(directory), "error": "directory does not exist"}
+    classifier = get_classifier(_extensions(args))
+    sniffer = get_sniffer() if args.sniff else None
+    files, sizes = Counter(), Counter()
+    for root, names in _walk_tree(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                count_fs_call("stat")
+                stat = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            category = classifier.match(name)[1]
+            if category is None and sniffer is not None:
+                category = classifier.table.get(sniffer.sniff(path, stat))
+            category = category or classifier.default
+            files[category] += 1
+            sizes[category] += stat.st_size
+    if sniffer is not None:
+        sniffer.save()
+    return {
+        "directory": str(directory),
+        "categories": {
+            category: {"files": files[category], "bytes": sizes[category]}
+            for category in sorted(files)
+        },
+    }
+
+
+def _watch(args):
+    from .utils import ensure_folder_paths_file_exists, get_sort_targets
+    from .watcher import watch_directories
+
+    if args.directories:
+        extensions = _extensions(args)
+        targets = [(directory, extensions) for directory in args.directories]
+    else:
+        ensure_folder_paths_file_exists()
+        targets = get_sort_targets()
+    missing = [directory for directory, _ in targets if not directory.is_dir()]
+    if missing:
+        return [
+            {"directory": str(directory), "error": "directory does not exist"}
+            for directory in missing
+        ]
+    moved = watch_directories(
+        targets,
+        settle=args.settle,
+        interval=args.poll_interval,
+        polling=args.polling,
+        workers=args.workers,
+        dedup=args.dedup,
+        folder_budget=_folder_budget(args),
+        use_folder_cache=not args.no_cache,
+        sniff=args.sniff,
+        collisions=args.on_collision,
+    )
+    return [
+        {"directory": directory, "moved": count} for directory, count in moved.items()
+    ]
+
+
+def run_cli(argv):
+    """Run one command without the updater or the menus; return the exit code."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    _check_deep_options(parser, args)
+    from . import instrument
+    from .logger import setup_logging
+    from .utils import ensure_log_file_exists
+
+    start = time.perf_counter()
+    fs_calls.clear()
+    ensure_log_file_exists()
+    setup_logging(args.log_format)
+    if args.profile:
+        instrument.enable(args.profile)
+    else:
+        instrument.enable_from_environment()
+    try:
+        return _run_command(args, start)
+    finally:
+        for path in instrument.disable():
+            print(f"Profile written to {path}", file=sys.stderr)
+
+
+def _check_deep_options(parser, args):
+    # Deep mode moves files one by one and never classifies a folder, so
+    # the budgets of the folder walk cannot apply
+    if not getattr(args, "deep", False):
+        return
+    for option in ("--max-files", "--max-depth"):
+        if getattr(args, option[2:].replace("-", "_")) is not None:
+            parser.error(f"argument {option}: not allowed with argument --deep")
+
+
+def _run_command(args, start):
+    if args.command == "plan":
+        from .deepsort import build_deep_plan
+        from .utils import build_plan, export_plan, print_plan
+
+        if not args.directory.is_dir():
+            print(f"The directory {args.directory} does not exist.", file=sys.stderr)
+            return 1
+        if args.deep:
+            plan = build_deep_plan(
+                args.directory,
+                _extensions(args),
+                args.depth,
+                args.processes,
+                args.sniff,
+                args.on_collision,
+            )
+        else:
+            plan = build_plan(
+                args.directory,
+                _extensions(args),
+                _folder_budget(args),
+                not args.no_cache,
+                args.sniff,
+                args.on_collision,
+            )
+        if args.export:
+            export_plan(plan, args.export)
+        else:
+            print_plan(plan)
+        return 0
+
+    # Messages printed while working go to stderr, stdout only gets the summary
+    with redirect_stdout(sys.stderr):
+        if args.command in ("sort", "sort-all"):
+            progress = _progress(args)
+        if args.command == "sort" and args.deep:
+            results = [
+                _deep_sort(directory, args, progress) for directory in args.directories
+            ]
+        elif args.command == "sort":
+            extensions = _extensions(args)
+            results = _sort_targets(
+                [(directory, extensions) for directory in args.directories],
+                args,
+                progress,
+            )
+        elif args.command == "sort-all":
+            from .utils import ensure_folder_paths_file_exists, get_sort_targets
+
+            ensure_folder_paths_file_exists()
+            results = _sort_targets(get_sort_targets(), args, progress)
+        elif args.command == "stats":
+            results = [_stats(directory, args) for directory in args.directories]
+        elif args.command == "watch":
+            results = _watch(args)
+        elif args.command == "undo":
+            results = [_undo()]
+        if args.command in ("sort", "sort-all"):
+            progress.close()
+    summary = _summary(args.command, results, start)
+    print(json.dumps(summary))
+    return 0 if summary["ok"] else 1
@@ -0,0 +1,90 @@
+import os
+from .shared import count_fs_call
+
+COLLISION_POLICIES = ("rename", "skip", "overwrite-newer")
+
+
+def numbered_name(name, number):
+    """Return name with a counter before its extension: "photo (1).jpg"."""
+    stem, extension = os.path.splitext(name)
+    if stem.lower().endswith(".tar"):  # Keep ".tar.gz" and friends together
+        stem, extension = stem[:-4], stem[-4:] + extension
+    if not stem:  # Dot files like ".bashrc" have no extension
+        stem, extension = extension, ""
+    return f"{stem} ({number}){extension}"
+
+
+class TargetNames:
+    """Names present in target directories, each listed once with scandir.
+
+    Names claimed by planned moves are added as they are assigned, so every
+    collision check after the first listing is a set lookup.
+    """
+
+    def __init__(self):
+        # Directory -> {name: DirEntry, or None once claimed by a move}; names
+        # go through normcase, case-insensitive on Windows
+        self.entries = {}
+
+    def names(self, directory):
+        names = self.entries.get(directory)
+        if names is None:
+            names = self.entries[directory] = {}
+            try:
+                count_fs_call("scandir")
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        names[os.path.normcase(entry.name)] = entry
+            except OSError:
+                pass  # Created by the move itself
+        return names
+
+
+def _mtime(entry):
+    count_fs_call("stat")
+    return entry.stat(follow_symlinks=False).st_mtime_ns
+
+
+def resolve_collisions(moves, policy="rename"):
+    """Return moves with their destinations made free according to policy.
+
+    "rename" adds the first free counter to the name, "skip" drops the move
+    and "overwrite-newer" keeps it only when the source is newer than the
+    file it replaces (folders are never overwritten, they are skipped).
+    Counters are handed out in source order, so the result does not depend
+    on the order in which the directory was listed.
+    """
+    if policy not in COLLISION_POLICIES:
+        raise ValueError(f"Unknown collision policy: {policy}")
+    targets = TargetNames()
+    resolved = {}
+    for index in sorted(range(len(moves)), key=lambda index: moves[index].source):
+        move = moves[index]
+        directory, name = os.path.split(move.destination)
+        names = targets.names(directory)
+        existing = names.get(os.path.normcase(name), False)
+        if existing is False:
+            names[os.path.normcase(name)] = None
+            resolved[index] = move
+        elif policy == "rename":
+            number = 1
+            while os.path.normcase(numbered_name(name, number)) in names:
+                number += 1
+            name = numbered_name(name, number)
+            names[os.path.normcase(name)] = None
+            resolved[index] = move._replace(destination=os.path.join(directory, name))
+        elif (
+            policy == "overwrite-newer"
+            and move.kind == "file"
+            and existing is not None
+            and existing.is_file(follow_symlinks=False)
+        ):
+            try:
+                count_fs_call("stat")
+                newer = os.stat(move.source).st_mtime_ns > _mtime(existing)
+            except OSError:
+                newer = False
+            if newer:
+                names[os.path.normcase(name)] = None
+                resolved[index] = move
+    return tuple(resolved[index] for index in sorted(resolved))
@@ -12,6 +12,21 @@ MENU_CHOICE = [
     "11",
     "12",
 ]  # List of the menu choices
+DUPLICATES_FOLDER = "Doublons"  # Duplicates set aside by the quarantine policy
+# Choices and defaults of the command line options, kept here so that the
+# parser is built without importing the modules that use them
+LOG_FORMATS = ("text", "json")
+LOG_FORMAT_ENV = "GLOBALSORT_LOG_FORMAT"
+PROFILE_ENV = "GLOBALSORT_PROFILE"  # e.g. GLOBALSORT_PROFILE=timers,tracemalloc
+PROFILE_MODES = ("timers", "cprofile", "tracemalloc")
+DEDUP_POLICIES = ("skip", "hardlink", "quarantine")
+PIPELINE_CONCURRENCY = 4  # Blocking filesystem calls running at the same time
+# Calls running at the same time on one device; keeps hard disks from seeking
+# back and forth between directories
+PIPELINE_DEVICE_CONCURRENCY = 2
+DEEP_SORT_DEPTH = 2  # Levels of subfolders flattened by default
+WATCH_SETTLE_SECONDS = 2.0  # An entry is moved once unchanged for this long
+WATCH_POLL_SECONDS = 2.0  # Polling period, and idle wake-up of the inotify loop
 EXTENSIONS_MUSIC = {
     ".mp3": "Musique",
     ".wav": "Musique",
@@ -37,7 +52,6 @@ EXTENSIONS_IMAGE = {
     ".bmp": "Images",
     ".png": "Images",
     ".jpg": "Images",
-    ".JPG": "Images",
     ".jpeg": "Images",
     ".heic": "Images",
     ".svg": "Images",
@@ -53,6 +67,10 @@ EXTENSIONS_DOCUMENT = {
     ".pdf": "Documents",
     ".doc": "Documents",
     ".zip": "Documents",
+    ".tar.gz": "Documents",
+    ".tar.bz2": "Documents",
+    ".tar.xz": "Documents",
+    ".tar.zst": "Documents",
     ".docx": "Documents",
 }
 
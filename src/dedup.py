@@ -0,0 +1,181 @@
+import hashlib
+import mmap
+import os
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .collisions import resolve_collisions
+from .constants import DEDUP_POLICIES, DUPLICATES_FOLDER
+from .logger import log_message
+from .records import MoveRecords
+from .shared import count_fs_call
+
+DEDUP_WORKERS = 4
+PARTIAL_HASH_BLOCK = 64 * 1024  # Read at both ends of a file by the partial hash
+
+# A file of the plan whose content is already in original
+Duplicate = namedtuple("Duplicate", "path original size")
+DedupReport = namedtuple(
+    "DedupReport", "policy duplicates bytes_saved bytes_hashed seconds"
+)
+
+
+def _partial_hash(path, size):
+    # First and last blocks; for small files this is the whole content
+    count_fs_call("read")
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(PARTIAL_HASH_BLOCK))
+        if size > PARTIAL_HASH_BLOCK:
+            f.seek(max(PARTIAL_HASH_BLOCK, size - PARTIAL_HASH_BLOCK))
+            digest.update(f.read(PARTIAL_HASH_BLOCK))
+    return digest.hexdigest(), min(size, 2 * PARTIAL_HASH_BLOCK)
+
+
+def _full_hash(path, size):
+    count_fs_call("read")
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            digest.update(mapped)  # hashlib releases the GIL on large buffers
+    return digest.hexdigest(), size
+
+
+def _hash_job(function, job):
+    try:
+        return function(*job)
+    except (OSError, ValueError):
+        return None, 0  # Unreadable, or emptied while being hashed
+
+
+def find_duplicates(files, workers=DEDUP_WORKERS):
+    """Group files with identical content and return (groups, bytes_hashed).
+
+    ``files`` is a list of (path, size). Files are grouped by size first, then
+    by a hash of their first and last blocks, and only the candidates left
+    are hashed in full. Paths keep the order of ``files`` within a group.
+    """
+    by_size = defaultdict(list)
+    for path, size in files:
+        if size > 0:
+            by_size[size].append(path)
+    candidates = [(size, group) for size, group in by_size.items() if len(group) > 1]
+    groups = []
+    bytes_hashed = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for function in (_partial_hash, _full_hash):
+            jobs = [(path, size) for size, group in candidates for path in group]
+            results = executor.map(_hash_job, [function] * len(jobs), jobs)
+            grouped = defaultdict(list)
+            for (path, size), (digest, hashed) in zip(jobs, results):
+                bytes_hashed += hashed
+                if digest is not None:
+                    grouped[size, digest].append(path)
+            candidates = []
+            for (size, _), group in grouped.items():
+                if len(group) < 2:
+                    continue
+                # The partial hash of a small file already covers all of it
+                if function is _full_hash or size <= 2 * PARTIAL_HASH_BLOCK:
+                    groups.append(group)
+                else:
+                    candidates.append((size, group))
+    return groups, bytes_hashed
+
+
+def _sorted_files(plan, sizes):
+    # Files already in the target folders, limited to the sizes of the plan
+    files = []
+    for directory in sorted({os.path.dirname(move.destination) for move in plan.moves}):
+        try:
+            count_fs_call("scandir")
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        count_fs_call("stat")
+                        size = entry.stat(follow_symlinks=False).st_size
+                        if size in sizes:
+                            files.append((entry.path, size))
+        except OSError:
+            continue  # Not created yet
+    return files
+
+
+def dedup_plan(plan, policy="skip", workers=DEDUP_WORKERS):
+    """Find the files of plan whose content is already sorted or planned.
+
+    The first copy of a content is kept: a file already in a target folder,
+    otherwise the first planned one. Returns (plan, DedupReport), where the
+    plan has the duplicates removed ("skip"), sent to the duplicates folder
+    ("quarantine") or unchanged ("hardlink", see link_duplicates).
+    """
+    if policy not in DEDUP_POLICIES:
+        raise ValueError(f"Unknown dedup policy: {policy}")
+    start = time.perf_counter()
+    moves = {move.source: move for move in plan.moves if move.kind == "file"}
+    planned = [(move.source, move.size) for move in moves.values()]
+    existing = _sorted_files(plan, {size for _, size in planned})
+    groups, bytes_hashed = find_duplicates(existing + planned, workers)
+
+    duplicates = []
+    for group in groups:
+        original = group[0]
+        for path in group[1:]:
+            if path in moves:
+                duplicates.append(Duplicate(path, original, moves[path].size))
+
+    duplicate_paths = {duplicate.path for duplicate in duplicates}
+    kept, quarantined = [], []
+    for move in plan.moves:
+        if move.source not in duplicate_paths or policy == "hardlink":
+            kept.append(move)
+        elif policy == "quarantine":
+            destination = os.path.join(
+                plan.directory, DUPLICATES_FOLDER, os.path.basename(move.source)
+            )
+            quarantined.append(
+                move._replace(destination=destination, category=DUPLICATES_FOLDER)
+            )
+    # Copies quarantined by earlier runs keep their names
+    kept.extend(resolve_collisions(quarantined, "rename"))
+    report = DedupReport(
+        policy,
+        tuple(duplicates),
+        sum(duplicate.size for duplicate in duplicates),
+        bytes_hashed,
+        time.perf_counter() - start,
+    )
+    log_message("info", format_dedup_report(report))
+    return plan._replace(moves=MoveRecords(kept)), report
+
+
+def link_duplicates(report):
+    """Replace each duplicate by a hard link to its original; return the count.
+
+    The links are then moved like the files they replace. Duplicates on
+    another device than their original are left as they are.
+    """
+    linked = 0
+    for duplicate in report.duplicates:
+        temporary = duplicate.path + ".globalsort-link"
+        try:
+            count_fs_call("link")
+            os.link(duplicate.original, temporary)
+            os.replace(temporary, duplicate.path)
+            linked += 1
+        except OSError as e:
+            log_message("warning", f"Could not link {duplicate.path}: {e}")
+            if os.path.lexists(temporary):
+                os.unlink(temporary)
+    return linked
+
+
+def format_dedup_report(report):
+    megabytes = report.bytes_hashed / (1024 * 1024)
+    throughput = megabytes / report.seconds if report.seconds > 0 else 0.0
+    return (
+        f"Dedup ({report.policy}): {len(report.duplicates)} duplicates, "
+        f"{report.bytes_saved} bytes saved, {megabytes:.1f} MiB hashed "
+        f"at {throughput:.1f} MiB/s"
+    )
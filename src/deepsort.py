@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from .classifier import get_classifier
+from .collisions import resolve_collisions
+from .constants import DEEP_SORT_DEPTH, DUPLICATES_FOLDER
+from .dedup import dedup_plan, link_duplicates
+from .logger import log_message
+from .report import run_record, write_run_records
+from .shared import count_fs_call
+from .sniffer import get_sniffer
+from .records import MoveRecords
+from .utils import (
+    MovePlan,
+    PlannedMove,
+    scan_directory,
+    execute_plan,
+    _walk_tree,
+)
+
+# The walkers are not forked: the parent runs threads, such as the one
+# writing the log, whose locks a forked child could inherit held
+DEEP_SORT_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def _plan_subtree(job):
+    # Worker side: classify every file of one subtree, down to max_depth
+    # levels below it. Returns (path, size, category or None) tuples.
+    subtree, extensions, max_depth = job
+    classifier = get_classifier(extensions)
+    found = []
+    for root, names in _walk_tree(subtree, max_depth):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            found.append((path, stat.st_size, classifier.match(name)[1]))
+    return found
+
+
+def build_deep_plan(
+    directory,
+    extensions,
+    max_depth=DEEP_SORT_DEPTH,
+    processes=None,
+    sniff=False,
+    collisions="rename",
+):
+    """Plan moving every file up to max_depth levels deep into its category.
+
+    Files of subfolders are moved one by one instead of with their folder,
+    and the subfolders are walked in parallel, one subtree per process.
+    Category folders at the top of directory are left alone. The plans of
+    the subtrees are merged and their names made unique in a single pass.
+    ``processes`` of 1 walks the subtrees in this process.
+    """
+    directory = os.fspath(directory)
+    classifier = get_classifier(extensions)
+    table = dict(classifier.table)
+    files, folders = scan_directory(directory)
+    skipped = set(classifier.reverse) | {classifier.default, DUPLICATES_FOLDER}
+    jobs = [
+        (entry.path, table, max_depth - 1)
+        for entry in folders
+        if entry.name not in skipped and not entry.is_symlink()
+    ]
+
+    found = []
+    for entry in files:
+        count_fs_call("stat")
+        try:
+            size = entry.stat().st_size
+        except OSError:
+            size = 0
+        found.append((entry.path, size, classifier.match(entry.name)[1]))
+    if max_depth > 0 and jobs:
+        if processes == 1 or len(jobs) == 1:
+            subtrees = map(_plan_subtree, jobs)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context(DEEP_SORT_START_METHOD),
+            ) as executor:
+                subtrees = list(executor.map(_plan_subtree, jobs))
+        for subtree in subtrees:
+            count_fs_call("stat", len(subtree))
+            found.extend(subtree)
+
+    sniffer = get_sniffer() if sniff else None
+    moves = []
+    for path, size, category in found:
+        if category is None and sniffer is not None:
+            category = classifier.table.get(sniffer.sniff(path))
+        if category is None:
+            category = classifier.default
+        destination = os.path.join(directory, category, os.path.basename(path))
+        moves.append(PlannedMove(path, destination, size, category, "file"))
+    if sniffer is not None:
+        sniffer.save()
+    moves = MoveRecords(resolve_collisions(moves, collisions))
+    return MovePlan(directory, os.path.realpath(directory), moves)
+
+
+def _prune_empty_folders(plan):
+    # Remove the subfolders emptied by the moves, deepest first
+    folders = set()
+    for move in plan.moves:
+        parent = os.path.dirname(move.source)
+        while parent != plan.directory and parent.startswith(plan.directory):
+            folders.add(parent)
+            parent = os.path.dirname(parent)
+    removed = 0
+    for folder in sorted(folders, key=len, reverse=True):
+        try:
+            os.rmdir(folder)
+            removed += 1
+        except OSError:
+            pass  # Still holds entries deeper than max_depth, or failed moves
+    return removed
+
+
+def deep_sort(directory, extensions, workers=1, progress=None, dedup=None, **options):
+    """Deep-sort directory and return (moved_count, sorted_folders).
+
+    ``options`` go to build_deep_plan, ``dedup`` is a dedup_plan policy and
+    ``progress`` is an optional SortProgress. Folders left empty are removed.
+    """
+    plan = build_deep_plan(directory, extensions, **options)
+    scanned = len(plan.moves)
+    if dedup is not None:
+        plan, report = dedup_plan(plan, dedup)
+        if dedup == "hardlink":
+            link_duplicates(report)
+    moved, sorted_folders = execute_plan(plan, workers, progress=progress)
+    removed = _prune_empty_folders(plan)
+    write_run_records(
+        [run_record(directory, scanned, len(plan.moves), moved, progress)]
+    )
+    log_message(
+        "info",
+        f"Deep-sorted {directory}: {moved} files moved, {removed} empty folders removed",
+    )
+    return moved, sorted_folders
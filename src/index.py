@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from .classifier import get_classifier
+from .logger import log_message
+from .shared import count_fs_call
+
+SORT_INDEX_FILE = "User_Files/sort_index.sqlite3"
+# Entries modified this recently may change again within the same mtime tick,
+# so they are not recorded as settled yet (see FOLDER_CACHE_RACY_SECONDS)
+SORT_INDEX_RACY_SECONDS = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    config TEXT NOT NULL,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS entries (
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (directory, name)
+);
+"""
+
+
+def index_config(
+    extensions, folder_budget=None, sniff=False, dedup=None, collisions="rename", **_
+):
+    """Return a digest of everything that decides where entries go.
+
+    Entries settled under another extension map or other options are looked
+    at again. Options that do not change the outcome are ignored.
+    """
+    classifier = get_classifier(extensions)
+    state = [
+        sorted(classifier.table.items()),
+        [(regex.pattern, category) for regex, category in classifier.rules],
+        sorted((folder_budget or {}).items()),
+        sniff,
+        dedup,
+        collisions,
+    ]
+    return hashlib.sha1(json.dumps(state).encode("utf-8")).hexdigest()
+
+
+class SortIndex:
+    """SQLite index of the entries left in place by the last sort of a directory.
+
+    After a sort, every entry still at the top of the directory (category
+    folders, entries skipped or that failed) is recorded with its inode and
+    mtime, together with the mtime of the directory. The next sort skips the
+    directory outright when its mtime did not change, and otherwise only
+    plans the entries that are new or changed.
+    """
+
+    def __init__(self, path=SORT_INDEX_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Plans are built on several threads; one connection behind a lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def unchanged(self, directory, config):
+        """Return True if nothing was added to directory since its last sort."""
+        key = os.path.realpath(directory)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT config, mtime_ns FROM directories WHERE path = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] != config or row[1] is None:
+            return False
+        try:
+            count_fs_call("stat")
+            return os.stat(directory).st_mtime_ns == row[1]
+        except OSError:
+            return False
+
+    def changed_entries(self, directory, config, files, folders):
+        """Return the (files, folders) DirEntry lists minus the settled entries."""
+        key = os.path.realpath(directory)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT config FROM directories WHERE path = ?", (key,)
+            ).fetchone()
+            if row is None or row[0] != config:
+                return files, folders
+            settled = {
+                name: (inode, mtime_ns)
+                for name, inode, mtime_ns in self._connection.execute(
+                    "SELECT name, inode, mtime_ns FROM entries WHERE directory = ?",
+                    (key,),
+                )
+            }
+
+        def is_new(entry):
+            known = settled.get(entry.name)
+            if known is None:
+                return True
+            try:
+                count_fs_call("stat")
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                return True
+            return (stat.st_ino, stat.st_mtime_ns) != known
+
+        return (
+            [entry for entry in files if is_new(entry)],
+            [entry for entry in folders if is_new(entry)],
+        )
+
+    def record(self, directory, config, known_names):
+        """Remember the entries left at the top of directory after a sort.
+
+        ``known_names`` are the names the sort knew about: the entries it
+        scanned and the folders it moved entries into. Anything else arrived
+        during the sort, so the directory mtime is not recorded and the next
+        run lists the directory again.
+        """
+        key = os.path.realpath(directory)
+        racy_limit = time.time_ns() - SORT_INDEX_RACY_SECONDS * 1_000_000_000
+        rows = []
+        complete = True
+        try:
+            count_fs_call("stat")
+            mtime_ns = os.stat(directory).st_mtime_ns
+            count_fs_call("scandir")
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name not in known_names:
+                        complete = False
+                        continue
+                    count_fs_call("stat")
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime_ns > racy_limit:
+                        complete = False
+                        continue
+                    rows.append((key, entry.name, stat.st_ino, stat.st_mtime_ns))
+        except OSError as e:
+            log_message("warning", f"Could not index {directory}: {e}")
+            return
+        if not complete or mtime_ns > racy_limit:
+            mtime_ns = None
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+                (key, config, mtime_ns),
+            )
+            self._connection.execute("DELETE FROM entries WHERE directory = ?", (key,))
+            self._connection.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?)", rows
+            )
+
+
+def known_names(plan, files, folders):
+    """Return the names a sort of plan may leave in its directory.
+
+    These are the scanned entries the plan did not move, and the folders it
+    moved entries into. Planned entries still there after the sort failed
+    to move and are looked at again next time.
+    """
+    names = {entry.name for entry in files} | {entry.name for entry in folders}
+    for move in plan.moves:
+        names.discard(os.path.basename(move.source))
+    for move in plan.moves:
+        names.add(os.path.relpath(move.destination, plan.directory).split(os.sep)[0])
+    return names
+
+
+_sort_index = None
+_sort_index_lock = threading.Lock()
+
+
+def get_sort_index():  # Open the database on first use
+    global _sort_index
+    with _sort_index_lock:
+        if _sort_index is None:
+            _sort_index = SortIndex(SORT_INDEX_FILE)
+    return _sort_index
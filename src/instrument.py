@@ -0,0 +1,189 @@
+import atexit
+import functools
+import importlib
+import io
+import os
+import sys
+import threading
+import time
+from .constants import PROFILE_ENV, PROFILE_MODES
+from .shared import fs_calls
+
+PROFILE_DIR = "User_Files"
+PROFILE_TOP = 30  # Lines of the cProfile and tracemalloc reports
+# (module, function) timed while instrumentation is on
+INSTRUMENTED = (
+    ("utils", "sort_directory"),
+    ("utils", "scan_directory"),
+    ("utils", "plan_entries"),
+    ("utils", "get_folder_category"),
+    ("utils", "execute_plan"),
+    ("mover", "fast_move"),
+    ("undo", "undo_latest_session"),
+    ("undo", "_restore"),
+    ("logger", "log_message"),
+)
+
+timings = {}  # Name -> [calls, seconds]
+_timings_lock = threading.Lock()
+_modes = ()
+_start = None
+_profiler = None
+_patched = []  # (module, attribute, original) to put back on disable()
+
+
+def parse_modes(value):
+    """Split a comma separated list of PROFILE_MODES; raise ValueError."""
+    modes = tuple(mode.strip() for mode in value.split(",") if mode.strip())
+    for mode in modes:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+    return modes
+
+
+def is_enabled():
+    return bool(_modes)
+
+
+def record(name, seconds, calls=1):
+    with _timings_lock:
+        entry = timings.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+
+
+def _timed(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def _patch(original, wrapper):
+    # Replace the function in every module of the package that imported it,
+    # so calls through "from .utils import scan_directory" are timed too;
+    # modules outside the package are left alone
+    prefix = f"{__package__}."
+    for name, module in list(sys.modules.items()):
+        if not name.startswith(prefix):
+            continue
+        for attribute, value in list(getattr(module, "__dict__", {}).items()):
+            if value is original:
+                setattr(module, attribute, wrapper)
+                _patched.append((module, attribute, original))
+
+
+def enable(modes=("timers",)):
+    """Start the instrumentation; the reports are written at exit.
+
+    "timers" wraps the INSTRUMENTED functions, "cprofile" profiles the main
+    thread and "tracemalloc" traces the allocations.
+    """
+    global _modes, _start, _profiler
+    if _modes:
+        return
+    _modes = tuple(modes)
+    _start = time.perf_counter()
+    timings.clear()
+    if "timers" in _modes:
+        for module_name, name in INSTRUMENTED:
+            module = importlib.import_module(f"{__package__}.{module_name}")
+            original = getattr(module, name)
+            _patch(original, _timed(f"{module_name}.{name}", original))
+    # The profilers are only imported when asked for, to keep them off the
+    # start-up of every run
+    if "tracemalloc" in _modes:
+        import tracemalloc
+
+        tracemalloc.start(10)
+    if "cprofile" in _modes:
+        import cProfile
+
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.unregister(disable)
+    atexit.register(disable)
+
+
+def enable_from_environment():
+    """Enable the modes listed in GLOBALSORT_PROFILE, if it is set."""
+    value = os.environ.get(PROFILE_ENV)
+    if value:
+        enable(parse_modes(value))
+
+
+def disable():
+    """Stop the instrumentation, restore the functions and write the reports.
+
+    Returns the paths of the reports written.
+    """
+    global _modes, _profiler
+    if not _modes:
+        return []
+    if _profiler is not None:
+        _profiler.disable()
+    for module, attribute, original in reversed(_patched):
+        setattr(module, attribute, original)
+    _patched.clear()
+    try:
+        return write_reports(time.perf_counter() - _start)
+    finally:
+        if "tracemalloc" in _modes:
+            import tracemalloc
+
+            tracemalloc.stop()
+        _modes, _profiler = (), None
+
+
+def format_timings(elapsed):
+    lines = [
+        f"{'function':<32} {'calls':>9} {'total s':>10} {'mean ms':>10} {'share':>7}"
+    ]
+    for name, (calls, seconds) in sorted(
+        timings.items(), key=lambda item: item[1][1], reverse=True
+    ):
+        share = seconds / elapsed if elapsed > 0 else 0.0
+        lines.append(
+            f"{name:<32} {calls:>9} {seconds:>10.3f} "
+            f"{seconds / calls * 1000:>10.3f} {share:>7.1%}"
+        )
+    if fs_calls:
+        details = ", ".join(f"{n}={c}" for n, c in sorted(fs_calls.items()))
+        lines.append(f"Filesystem calls of the last sort: {details}")
+    return "\n".join(lines)
+
+
+def write_reports(elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+    written = []
+    if "timers" in _modes:
+        with open(f"{base}-timers.txt", "w", encoding="utf-8") as f:
+            f.write(f"Instrumented for {elapsed:.3f}s\n{format_timings(elapsed)}\n")
+        written.append(f"{base}-timers.txt")
+    if _profiler is not None:
+        import pstats
+
+        _profiler.dump_stats(f"{base}.pstats")  # For snakeviz and friends
+        text = io.StringIO()
+        stats = pstats.Stats(_profiler, stream=text)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with open(f"{base}-cprofile.txt", "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+        written += [f"{base}.pstats", f"{base}-cprofile.txt"]
+    if "tracemalloc" in _modes:
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        with open(f"{base}-tracemalloc.txt", "w", encoding="utf-8") as f:
+            f.write(f"Current {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB\n")
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                f.write(f"{stat}\n")
+        written.append(f"{base}-tracemalloc.txt")
+    return written
@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+UNDO_JOURNAL_FILE = "User_Files/undo_journal.jsonl"
+UNDO_JOURNAL_SYNC_EVERY = 512  # Records written between two fsync calls
+UNDO_JOURNAL_MAX_SESSIONS = 20  # Older sessions are dropped when a new one starts
+_BLOCK_SIZE = 64 * 1024
+
+
+class UndoJournal:
+    """Append-only undo log on disk, used in place of a list of moves.
+
+    Each line is a JSON array ``[session, moved_to, original_location]``.
+    Every process is a session, so the moves of an interrupted sort can still
+    be reverted by the next run. Records are flushed on every append and
+    fsync-ed in batches, and they are read back from the end of the file
+    block by block, so undoing never loads the whole log into memory.
+    """
+
+    def __init__(
+        self,
+        path=UNDO_JOURNAL_FILE,
+        sync_every=UNDO_JOURNAL_SYNC_EVERY,
+        max_sessions=UNDO_JOURNAL_MAX_SESSIONS,
+    ):
+        self.path = path
+        self.sync_every = sync_every
+        self.max_sessions = max_sessions
+        self.session = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._file = None
+        self._unsynced = 0
+        self._count = 0  # Records of this session still in the journal
+        self._lock = threading.Lock()
+
+    # List-like interface, limited to the records of this session
+
+    def append(self, record):
+        moved_to, original_location = record
+        line = json.dumps(
+            [self.session, os.fspath(moved_to), os.fspath(original_location)]
+        )
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._count += 1
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._sync()
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self.latest_session() is not None
+
+    def __iter__(self):
+        for _, session, moved_to, original_location in self._records():
+            if session == self.session:
+                yield moved_to, original_location
+
+    def pop(self):
+        """Remove and return the last move of the latest session."""
+        with self._lock:
+            self._sync()
+            for offset, session, moved_to, original_location in self._iter_reverse():
+                self._close()
+                os.truncate(self.path, offset)
+                if session == self.session:
+                    self._count -= 1
+                return moved_to, original_location
+        raise IndexError("pop from an empty undo journal")
+
+    def clear(self):
+        self.drop_session(self.session)
+
+    # Journal specific interface
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def latest_session(self):
+        """Return the session of the last record, or None if there is none."""
+        for _, session, _, _ in self.iter_reverse():
+            return session
+        return None
+
+    def iter_reverse(self, session=None):
+        """Yield (offset, session, moved_to, original_location), newest first."""
+        self.sync()
+        for record in self._iter_reverse():
+            if session is None or record[1] == session:
+                yield record
+
+    def drop_session(self, session, keep=()):
+        """Forget the records of session, e.g. once it has been undone.
+
+        keep holds the offsets of records to leave in the journal, such as
+        moves that could not be undone and can be retried later.
+        """
+        keep = set(keep)
+        with self._lock:
+            self._sync()
+            self._close()
+            # The records of a session normally end the file and are cut off
+            # with one truncate; records interleaved with those of another
+            # process, or kept ones, are removed by rewriting the journal
+            cut, trailing, interleaved = None, True, False
+            for offset, record_session, _, _ in self._iter_reverse():
+                if record_session != session:
+                    trailing = False
+                elif trailing:
+                    cut = offset
+                else:
+                    interleaved = True
+                    break
+            if interleaved or keep:
+                self._rewrite(
+                    lambda offset, record_session: record_session != session
+                    or offset in keep
+                )
+            elif cut is not None:
+                os.truncate(self.path, cut)
+            if session == self.session:
+                self._count = len(keep)
+
+    # Internals
+
+    def _open(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._apply_retention()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def _records(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            for line in f:
+                record = _parse(line)
+                if record:
+                    yield (offset, *record)
+                offset += len(line)
+
+    def _iter_reverse(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            tail = b""
+            while end > 0:
+                start = max(0, end - _BLOCK_SIZE)
+                f.seek(start)
+                lines = (f.read(end - start) + tail).split(b"\n")
+                # The first piece may be the end of a line of the previous block
+                tail = lines.pop(0) if start > 0 else b""
+                offset = start + len(tail) + 1 if start > 0 else 0
+                offsets = []
+                for line in lines:
+                    offsets.append(offset)
+                    offset += len(line) + 1
+                for line, line_offset in zip(reversed(lines), reversed(offsets)):
+                    record = _parse(line)
+                    if record:
+                        yield (line_offset, *record)
+                end = start
+
+    def _rewrite(self, keep):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as out:
+            for offset, session, moved_to, original_location in self._records():
+                if keep(offset, session):
+                    out.write(
+                        json.dumps(
+                            [session, os.fspath(moved_to), os.fspath(original_location)]
+                        )
+                        + "\n"
+                    )
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temporary, self.path)
+
+    def _apply_retention(self):
+        # Called once per session, before its first record is written
+        sessions = {}
+        for _, session, _, _ in self._records():
+            sessions[session] = None
+        if len(sessions) >= self.max_sessions > 0:
+            kept = set(list(sessions)[len(sessions) - self.max_sessions + 1 :])
+            self._rewrite(lambda _, session: session in kept)
+
+
+def _parse(line):
+    try:
+        session, moved_to, original_location = json.loads(line)
+    except (ValueError, TypeError):
+        return None  # Empty or partly written line, e.g. after a crash
+    return session, Path(moved_to), Path(original_location)
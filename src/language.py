@@ -8,63 +8,68 @@ from .menu import (
 )
 from colorama import Fore
 
-LANGUAGE_FUNCTIONS = {
+LANGUAGE_SETTINGS = {  # Static settings, the menus are generated on demand
     "fr": {
-        "menu": generate_menu("fr"),
-        "help": generate_help_menu("fr"),
-        "choose_extensions": generate_menu_choose_extensions("fr"),
-        "edit_extensions": generate_menu_edit_extensions("fr"),
-        "edit_folder": generate_menu_edit_folder("fr"),
         "color": Fore.RED,
         "invalid_choice_message": "Veuillez entrer un choix valide",
     },
     "en": {
-        "menu": generate_menu("en"),
-        "help": generate_help_menu("en"),
-        "choose_extensions": generate_menu_choose_extensions("en"),
-        "edit_extensions": generate_menu_edit_extensions("en"),
-        "edit_folder": generate_menu_edit_folder("en"),
-        "edit_folder": generate_menu_edit_folder("en"),
         "color": Fore.GREEN,
         "invalid_choice_message": "Please enter a valid choice",
     },
     "es": {
-        "menu": generate_menu("es"),
-        "help": generate_help_menu("es"),
-        "choose_extensions": generate_menu_choose_extensions("es"),
-        "edit_extensions": generate_menu_edit_extensions("es"),
-        "edit_folder": generate_menu_edit_folder("es"),
         "color": Fore.YELLOW,
         "invalid_choice_message": "Por favor ingrese una opción válida",
     },
     "it": {
-        "menu": generate_menu("it"),
-        "help": generate_help_menu("it"),
-        "choose_extensions": generate_menu_choose_extensions("it"),
-        "edit_extensions": generate_menu_edit_extensions("it"),
-        "edit_folder": generate_menu_edit_folder("it"),
         "color": Fore.BLUE,
         "invalid_choice_message": "Si prega di inserire una scelta valida",
     },
     "de": {
-        "menu": generate_menu("de"),
-        "help": generate_help_menu("de"),
-        "choose_extensions": generate_menu_choose_extensions("de"),
-        "edit_extensions": generate_menu_edit_extensions("de"),
-        "edit_folder": generate_menu_edit_folder("de"),
         "color": Fore.MAGENTA,
         "invalid_choice_message": "Bitte geben Sie eine gültige Auswahl ein",
     },
     "ru": {
-        "menu": generate_menu("ru"),
-        "help": generate_help_menu("ru"),
-        "choose_extensions": generate_menu_choose_extensions("ru"),
-        "edit_extensions": generate_menu_edit_extensions("ru"),
-        "edit_folder": generate_menu_edit_folder("ru"),
         "color": Fore.CYAN,
         "invalid_choice_message": "Пожалуйста, введите действительный выбор",
     },
 }
+
+
+class LanguageFunctions(dict):
+    """Menus and settings per language, built the first time they are used.
+
+    Only the language of the system is normally needed, so the menus of the
+    other languages are never generated.
+    """
+
+    def __missing__(self, language):
+        if language not in LANGUAGE_SETTINGS:
+            raise KeyError(language)
+        functions = {
+            "menu": generate_menu(language),
+            "help": generate_help_menu(language),
+            "choose_extensions": generate_menu_choose_extensions(language),
+            "edit_extensions": generate_menu_edit_extensions(language),
+            "edit_folder": generate_menu_edit_folder(language),
+            **LANGUAGE_SETTINGS[language],
+        }
+        self[language] = functions
+        return functions
+
+    def __contains__(self, language):
+        return language in LANGUAGE_SETTINGS
+
+    def get(self, language, default=None):
+        try:
+            return self[language]
+        except KeyError:
+            return default
+
+
+LANGUAGE_FUNCTIONS = LanguageFunctions()
+
+
 DIRECTORY_NAMES = {  # Map directory names to the correct language
     "en": {
         "Music": "Music",
@@ -119,6 +124,7 @@ LOG_MESSAGES = {  # Map log messages to the correct language
         "console_cleared": "Console cleared",
         "extension_not_found": "Extension not found",
         "file_exists": "The file {file} already exists in {directory}",
+        "file_does_not_exist": "The file {src} does not exist.",
     },
     "fr": {
         "dir_not_exist": "Le répertoire {directory} n'existe pas.",
@@ -129,6 +135,7 @@ LOG_MESSAGES = {  # Map log messages to the correct language
         "console_cleared": "Console effacée",
         "extension_not_found": "Extension non trouvée",
         "file_exists": "Le fichier {file} existe déjà dans {directory}",
+        "file_does_not_exist": "Le fichier {src} n'existe pas.",
     },
     "es": {
         "dir_not_exist": "El directorio {directory} no existe.",
@@ -139,6 +146,7 @@ LOG_MESSAGES = {  # Map log messages to the correct language
         "console_cleared": "Consola borrada",
         "extension_not_found": "Extensión no encontrada",
         "file_exists": "El archivo {file} ya existe en {directory}",
+        "file_does_not_exist": "El archivo {src} no existe.",
     },
     "it": {
         "dir_not_exist": "La directory {directory} non esiste.",
@@ -149,6 +157,7 @@ LOG_MESSAGES = {  # Map log messages to the correct language
         "console_cleared": "Console cancellata",
         "extension_not_found": "Estensione non trovata",
         "file_exists": "Il file {file} esiste già in {directory}",
+        "file_does_not_exist": "Il file {src} non esiste.",
     },
     "de": {
         "dir_not_exist": "Das Verzeichnis {directory} existiert nicht.",
@@ -159,6 +168,7 @@ LOG_MESSAGES = {  # Map log messages to the correct language
         "console_cleared": "Konsole gelöscht",
         "extension_not_found": "Erweiterung nicht gefunden",
         "file_exists": "Die Datei {file} existiert bereits in {directory}",
+        "file_does_not_exist": "Die Datei {src} existiert nicht.",
     },
     "ru": {
         "dir_not_exist": "Каталог {directory} не существует.",
@@ -169,16 +179,25 @@ LOG_MESSAGES = {  # Map log messages to the correct language
         "console_cleared": "Консоль очищена",
         "extension_not_found": "Расширение не найдено",
         "file_exists": "Файл {file} уже существует в {directory}",
+        "file_does_not_exist": "Файл {src} не существует.",
     },
 }
+# Query the locale once, it is parsed again on every call
+system_locale = locale.getlocale()[0]
+
 # Get the user's operating system language, safely handling None
-os_language = locale.getlocale()[0][:2] if locale.getlocale()[0] else "en"
+os_language = system_locale[:2] if system_locale else "en"
 
-# Safely get the system language, default to 'en' if locale.getlocale()[0] is None
-lang = locale.getlocale()[0].split("_")[0] if locale.getlocale()[0] else "en"
+# Safely get the system language, default to 'en' if the locale is None
+lang = system_locale.split("_")[0] if system_locale else "en"
 
 # Safely get the correct log messages based on the OS language (default to English)
 messages = LOG_MESSAGES.get(os_language, LOG_MESSAGES["en"])
 
 # Safely get the correct directory names based on the system language (default to English)
 directories_name = DIRECTORY_NAMES.get(lang, DIRECTORY_NAMES["en"])
+
+
+def get_language_functions(language=None):
+    # Fall back to English without building it unless it is needed
+    return LANGUAGE_FUNCTIONS.get(language or os_language) or LANGUAGE_FUNCTIONS["en"]
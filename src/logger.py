@@ -1,13 +1,142 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import stat
+from .constants import LOG_FORMATS, LOG_FORMAT_ENV
 
+LOG_FILE = "User_Files/file_sorter.log"
+LOG_JSON_FILE = "User_Files/file_sorter.jsonl"
+LOG_MAX_BYTES = 5 * 1024 * 1024  # The log file is rotated past this size
+LOG_BACKUPS = 3  # Rotated files kept: file_sorter.log.1 to .3
+LOG_BATCH_SIZE = 512  # Records written between two flushes on busy runs
+DATE_FORMAT = "%d-%b-%y %H:%M:%S"
 
-def setup_logging():
-    logging.basicConfig(  # Configure the logging module
-        filename="User_Files/file_sorter.log",
-        level=logging.INFO,
-        format="%(asctime)s - %(message)s",
-        datefmt="%d-%b-%y %H:%M:%S",
+_listener = None
+_queue_handler = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, for log shippers."""
+
+    def format(self, record):
+        return json.dumps(
+            {
+                "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+                "level": record.levelname.lower(),
+                "message": record.getMessage(),
+            },
+            ensure_ascii=False,
+        )
+
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    # Same as RotatingFileHandler, without the flush after every record;
+    # the listener flushes once per batch. The size of the file is counted
+    # here, since the seek and tell of the stock check flush the buffer.
+    def __init__(self, *args, **kwargs):
+        self.size = 0
+        super().__init__(*args, **kwargs)
+
+    def _open(self):
+        stream = super()._open()
+        status = os.fstat(stream.fileno())
+        # Like the stock check, never rotate anything but a regular file
+        self.size = status.st_size if stat.S_ISREG(status.st_mode) else None
+        return stream
+
+    def shouldRollover(self, record, length=None):
+        if self.maxBytes <= 0 or not self.size:
+            return False
+        if length is None:
+            length = self._length(self.format(record) + self.terminator)
+        return self.size + length >= self.maxBytes
+
+    def _length(self, message):
+        return len(message.encode(self.encoding or "utf-8", "replace"))
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            message = self.format(record) + self.terminator
+            length = self._length(message)
+            if self.shouldRollover(record, length):
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(message)
+            if self.size is not None:
+                self.size += length
+        except Exception:
+            self.handleError(record)
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    # Flush the handlers when the queue runs dry or a batch is complete
+    def __init__(self, log_queue, *handlers):
+        super().__init__(log_queue, *handlers)
+        self.pending = 0
+
+    def handle(self, record):
+        super().handle(record)
+        self.pending += 1
+        if self.pending >= LOG_BATCH_SIZE or self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+            self.pending = 0
+
+
+def setup_logging(
+    log_format=None, path=None, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS
+):
+    """Send the log records to a background thread that writes the log file.
+
+    log_message only puts the record on a queue, so it never waits for the
+    disk. The file is rotated past max_bytes. log_format is "text" or
+    "json" (one JSON object per line), by default from GLOBALSORT_LOG_FORMAT.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    log_format = log_format or os.environ.get(LOG_FORMAT_ENV) or "text"
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format: {log_format}")
+    if path is None:
+        path = LOG_JSON_FILE if log_format == "json" else LOG_FILE
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = BufferedRotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True
     )
+    if log_format == "json":
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(message)s", datefmt=DATE_FORMAT)
+        )
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(_queue_handler)
+    _listener = BatchingQueueListener(log_queue, handler)
+    _listener.start()
+    atexit.unregister(stop_logging)
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write the records still queued and close the log file."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = _queue_handler = None
 
 
 def log_message(level, message):
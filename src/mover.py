@@ -0,0 +1,112 @@
+import errno
+import os
+import shutil
+from .shared import count_fs_call
+
+# Files at least this large are streamed in the kernel when copied across devices
+LARGE_FILE_THRESHOLD = 1024 * 1024
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Errors meaning "this copy method is not available here", not a real failure
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+    errno.ENOTSUP,
+}
+
+_device_cache = {}  # Directory path -> st_dev, filled once per directory
+
+
+def clear_device_cache():  # Forget the devices seen during a previous run
+    _device_cache.clear()
+
+
+def device_of(directory):
+    device = _device_cache.get(directory)
+    if device is None:
+        count_fs_call("stat")
+        device = os.stat(directory).st_dev
+        _device_cache[directory] = device
+    return device
+
+
+def fast_move(source, destination):
+    """Move source to destination, renaming in place when both share a device."""
+    source, destination = os.fspath(source), os.fspath(destination)
+    source_device = device_of(os.path.dirname(source) or ".")
+    target_device = device_of(os.path.dirname(destination) or ".")
+    if source_device == target_device:
+        try:
+            count_fs_call("rename")
+            os.rename(source, destination)
+            return destination
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                # Existing destinations and other edge cases keep the
+                # behaviour of shutil.move
+                count_fs_call("move")
+                return shutil.move(source, destination)
+    return _copy_and_delete(source, destination)
+
+
+def _copy_and_delete(source, destination):
+    # Cross-device move: copy the data, then remove the source
+    count_fs_call("copy")
+    if os.path.isdir(source) and not os.path.islink(source):
+        shutil.copytree(source, destination, symlinks=True, copy_function=copy_file)
+        shutil.rmtree(source)
+    else:
+        copy_file(source, destination)
+        os.unlink(source)
+    return destination
+
+
+def copy_file(source, destination, *, follow_symlinks=True):
+    if os.path.islink(source) and not follow_symlinks:
+        os.symlink(os.readlink(source), destination)
+        return destination
+    size = os.stat(source).st_size
+    if size < LARGE_FILE_THRESHOLD:
+        return shutil.copy2(source, destination)
+    with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+        _stream_copy(fsrc.fileno(), fdst.fileno(), size)
+    shutil.copystat(source, destination)
+    return destination
+
+
+def _stream_copy(fd_in, fd_out, size):
+    # Prefer copy_file_range (in-kernel, reflink aware), then sendfile, then a
+    # plain read/write loop on platforms that support neither. Offsets are
+    # explicit, so a method that gives up midway is resumed by the next one.
+    copied = 0
+    for kernel_copy in (_copy_file_range, _sendfile):
+        try:
+            while copied < size:
+                count = min(COPY_CHUNK_SIZE, size - copied)
+                sent = kernel_copy(fd_in, fd_out, copied, count)
+                if sent == 0:
+                    break
+                copied += sent
+            return
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+    os.lseek(fd_in, copied, os.SEEK_SET)
+    os.lseek(fd_out, copied, os.SEEK_SET)
+    while True:
+        chunk = memoryview(os.read(fd_in, COPY_CHUNK_SIZE))
+        if not chunk:
+            break
+        while chunk:
+            chunk = chunk[os.write(fd_out, chunk) :]
+
+
+def _copy_file_range(fd_in, fd_out, offset, count):
+    return os.copy_file_range(fd_in, fd_out, count, offset, offset)
+
+
+def _sendfile(fd_in, fd_out, offset, count):
+    os.lseek(fd_out, offset, os.SEEK_SET)
+    return os.sendfile(fd_out, fd_in, offset, count)
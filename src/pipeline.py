@@ -0,0 +1,357 @@
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .constants import PIPELINE_CONCURRENCY, PIPELINE_DEVICE_CONCURRENCY
+from .dedup import dedup_plan, link_duplicates
+from .index import get_sort_index, index_config, known_names
+from .logger import log_message
+from .mover import clear_device_cache
+from .progress import SortProgress
+from .report import run_record, write_run_records
+from .shared import fs_calls, count_fs_call
+from .utils import scan_directory, plan_entries, execute_plan, format_fs_calls
+
+PIPELINE_QUEUE_SIZE = 4  # Directories waiting between two stages
+
+
+class _Job:
+    # One target directory travelling through the stages
+    __slots__ = (
+        "index",
+        "directory",
+        "extensions",
+        "device",
+        "config",
+        "entries",
+        "known",
+        "plan",
+        "progress",
+        "result",
+    )
+
+    def __init__(self, index, directory, extensions, device, progress):
+        self.index = index
+        self.directory = directory
+        self.extensions = extensions
+        self.device = device
+        self.progress = progress
+        self.config = self.entries = self.known = self.plan = None
+        self.result = {"directory": str(directory)}
+
+
+async def _stage(work, inbox, outbox):
+    # One worker of a stage; failed and unchanged jobs are passed on untouched
+    while True:
+        job = await inbox.get()
+        if job is None:
+            return
+        if "error" not in job.result and not job.result.get("unchanged"):
+            try:
+                await work(job)
+            except Exception as e:
+                job.result["error"] = str(e)
+                log_message("error", f"Sorting {job.directory} failed: {e}")
+        await outbox.put(job)  # Waits while the next stage is saturated
+
+
+async def _run_stage(work, inbox, outbox, width):
+    await asyncio.gather(*(_stage(work, inbox, outbox) for _ in range(width)))
+    for _ in range(width):
+        await outbox.put(None)
+
+
+def device_of_target(directory):
+    """Return the st_dev of directory, or None if it cannot be reached."""
+    try:
+        count_fs_call("stat")
+        return os.stat(directory).st_dev
+    except OSError:
+        return None
+
+
+def _round_robin(jobs):
+    # Alternate between devices so that the first stage workers are not all
+    # waiting for the same device while the others stay idle
+    by_device = {}
+    for job in jobs:
+        by_device.setdefault(job.device, []).append(job)
+    queues = list(by_device.values())
+    ordered = []
+    for position in range(max((len(queue) for queue in queues), default=0)):
+        ordered.extend(queue[position] for queue in queues if position < len(queue))
+    return ordered
+
+
+async def sort_targets_async(
+    targets,
+    concurrency=PIPELINE_CONCURRENCY,
+    per_device=PIPELINE_DEVICE_CONCURRENCY,
+    workers=1,
+    dry_run=False,
+    dedup=None,
+    incremental=True,
+    progress=None,
+    **plan_options,
+):
+    """Sort (directory, extensions, device) targets concurrently.
+
+    Directories flow through scan, plan (classification, dedup, collisions)
+    and move stages joined by bounded queues, so a slow stage holds back the
+    ones before it. Blocking calls run on a thread pool; no more than
+    ``concurrency`` of them run at once over all stages, and no more than
+    ``per_device`` on the same device, counting the ``workers`` threads
+    that move the entries of a directory (fewer threads are used, with a
+    warning, when ``workers`` is higher). With ``incremental``, directories
+    and entries left as they were by the last sort are skipped (see
+    SortIndex). ``progress`` is an optional SortProgress fed by every
+    directory. ``plan_options`` go to plan_entries. Results are dicts in the
+    order of ``targets``, with the statistics of each directory.
+    """
+    index = get_sort_index() if incremental else None
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    per_device = max(1, per_device)
+    if workers > per_device:
+        log_message(
+            "warning",
+            f"Moving with {per_device} threads instead of {workers}: "
+            f"no more than {per_device} calls run at once on one device",
+        )
+    device_semaphores = {
+        device: asyncio.Semaphore(per_device) for _, _, device in targets
+    }
+    # Held while taking several slots of a device, so that two callers
+    # gathering slots never wait on each other
+    device_locks = {device: asyncio.Lock() for _, _, device in targets}
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def blocking(job, phase, function, *args, **kwargs):
+        return await device_blocking(job, 1, phase, function, *args, **kwargs)
+
+    async def device_blocking(job, slots, phase, function, /, *args, **kwargs):
+        # Run function with slots calls of the device to itself. Only the
+        # time spent running counts in the phase, not the waiting
+        device = device_semaphores[job.device]
+        async with device_locks[job.device]:
+            for _ in range(slots):
+                await device.acquire()
+        try:
+            async with semaphore:
+                return await loop.run_in_executor(
+                    executor,
+                    functools.partial(
+                        _timed, job.progress, phase, function, *args, **kwargs
+                    ),
+                )
+        finally:
+            for _ in range(slots):
+                device.release()
+
+    async def scan(job):
+        if job.device is None or not await blocking(
+            job, "scan", os.path.isdir, job.directory
+        ):
+            job.result["error"] = "directory does not exist"
+            return
+        if index is not None:
+            job.config = index_config(job.extensions, dedup=dedup, **plan_options)
+            if await blocking(job, "scan", index.unchanged, job.directory, job.config):
+                job.result["unchanged"] = True
+                job.result["moved"] = 0
+                return
+        job.entries = await blocking(job, "scan", scan_directory, job.directory)
+        job.result["scanned"] = len(job.entries[0]) + len(job.entries[1])
+
+    async def plan(job):
+        files, folders = job.entries
+        if index is not None:
+            files, folders = await blocking(
+                job,
+                "scan",
+                index.changed_entries,
+                job.directory,
+                job.config,
+                files,
+                folders,
+            )
+        job.plan = await blocking(
+            job,
+            "classify",
+            plan_entries,
+            job.directory,
+            files,
+            folders,
+            job.extensions,
+            **plan_options,
+        )
+        job.known = known_names(job.plan, *job.entries)
+        job.entries = None  # The DirEntry lists are no longer needed
+        if dedup is not None:
+            job.plan, report = await blocking(
+                job, "classify", dedup_plan, job.plan, dedup
+            )
+            job.result["duplicates"] = len(report.duplicates)
+            job.result["bytes_saved"] = report.bytes_saved
+            if dedup == "hardlink" and not dry_run:
+                await blocking(job, "classify", link_duplicates, report)
+        job.result["planned"] = len(job.plan.moves)
+
+    async def move(job):
+        if dry_run:
+            job.result["moved"] = 0
+            return
+        # The move threads of execute_plan all work on the device: they take
+        # every slot of it, and there are no more of them than slots
+        moved, sorted_folders = await device_blocking(
+            job,
+            per_device,
+            "move",
+            execute_plan,
+            job.plan,
+            min(workers, per_device),
+            progress=job.progress,
+        )
+        job.result["moved"] = moved
+        job.result["sorted_folders"] = sorted(sorted_folders)
+        if index is not None:
+            await blocking(
+                job, "move", index.record, job.directory, job.config, job.known
+            )
+
+    width = max(1, concurrency)
+    queued = asyncio.Queue()
+    scanned = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    planned = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    done = asyncio.Queue()
+    jobs = [
+        _Job(position, *target, SortProgress(str(target[0]), False, parent=progress))
+        for position, target in enumerate(targets)
+    ]
+    for job in _round_robin(jobs):
+        queued.put_nowait(job)
+    for _ in range(width):
+        queued.put_nowait(None)
+    try:
+        await asyncio.gather(
+            _run_stage(scan, queued, scanned, width),
+            _run_stage(plan, scanned, planned, width),
+            _run_stage(move, planned, done, width),
+        )
+    finally:
+        executor.shutdown(wait=True)
+
+    records = []
+    for job in jobs:
+        result = job.result
+        if "error" in result:
+            records.append(run_record(job.directory, error=result["error"]))
+            continue
+        state = job.progress.summary()
+        result.update(
+            bytes=state["bytes"],
+            categories=state["categories"],
+            phases=state["phases"],
+        )
+        if not dry_run:
+            record = run_record(
+                job.directory,
+                result.get("scanned", 0),
+                result.get("planned", 0),
+                result["moved"],
+                job.progress,
+                result.get("unchanged", False),
+            )
+            result.update(skipped=record["skipped"], failed=record["failed"])
+            records.append(record)
+    write_run_records(records)
+    return [job.result for job in jobs]
+
+
+def _timed(progress, phase, function, /, *args, **kwargs):
+    with progress.phase(phase):
+        return function(*args, **kwargs)
+
+
+def _nesting_waves(targets):
+    # A target inside another one is sorted first, never at the same time:
+    # sorting the outer one may move it away
+    paths = [os.path.realpath(directory) for directory, _, _ in targets]
+    waves = {}
+    for index, path in enumerate(paths):
+        depth = sum(
+            1
+            for other in set(paths)
+            if other != path and path.startswith(os.path.join(other, ""))
+        )
+        waves.setdefault(depth, []).append(index)
+    return [waves[depth] for depth in sorted(waves, reverse=True)]
+
+
+def _unique_targets(targets):
+    # (directory, extensions, device), each directory once
+    unique = []
+    seen = set()
+    for directory, extensions in targets:
+        key = os.path.realpath(directory)
+        if key not in seen:
+            seen.add(key)
+            unique.append((directory, extensions, device_of_target(directory)))
+    return unique
+
+
+def _sort_unique(unique, options):
+    results = [None] * len(unique)
+    for wave in _nesting_waves(unique):
+        wave_results = asyncio.run(
+            sort_targets_async([unique[index] for index in wave], **options)
+        )
+        for index, result in zip(wave, wave_results):
+            results[index] = result
+    log_message("info", format_fs_calls(f"{len(unique)} directories"))
+    return results
+
+
+def sort_targets(targets, **options):
+    """Run sort_targets_async over targets and return the results in order.
+
+    Targets are grouped by the device they live on, so that directories on
+    different devices are sorted in parallel while each device only gets
+    ``per_device`` calls at once. The same directory listed twice is only
+    sorted once, and directories nested in other targets are done before
+    them.
+    """
+    fs_calls.clear()
+    clear_device_cache()
+    return _sort_unique(_unique_targets(targets), options)
+
+
+def sort_all(targets, **options):
+    """Sort every target like sort_targets and return one consolidated result.
+
+    The result holds the number of directories and devices, the entries
+    moved, the sorted folders, the error of each directory that failed,
+    the elapsed seconds and the per-directory results.
+    """
+    start = time.perf_counter()
+    fs_calls.clear()
+    clear_device_cache()
+    unique = _unique_targets(targets)
+    results = _sort_unique(unique, options)
+    sorted_folders = set()
+    for result in results:
+        sorted_folders.update(result.get("sorted_folders", ()))
+    return {
+        "directories": len(results),
+        "devices": len({device for _, _, device in unique} - {None}),
+        "moved": sum(result.get("moved", 0) for result in results),
+        "sorted_folders": sorted(sorted_folders),
+        "errors": {
+            result["directory"]: result["error"]
+            for result in results
+            if "error" in result
+        },
+        "seconds": round(time.perf_counter() - start, 3),
+        "results": results,
+    }
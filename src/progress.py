@@ -0,0 +1,184 @@
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from colorama import Fore, Style
+from .instrument import is_enabled, record
+
+
+class ProgressBar:
+    """Single-line progress bar, redrawn at most once per interval.
+
+    Updating it is cheap enough to be called once per file; the terminal is
+    only written to when the interval has elapsed and on close().
+    """
+
+    def __init__(self, total, label="", interval=0.2, width=40, stream=None):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.width = width
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.start = time.perf_counter()
+        self._next_draw = self.start
+
+    def update(self, count=1):
+        self.count += count
+        now = time.perf_counter()
+        if now >= self._next_draw:
+            self._next_draw = now + self.interval
+            self.draw(now)
+
+    def draw(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        fraction = min(1.0, self.count / self.total) if self.total else 1.0
+        filled = int(self.width * fraction)
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        self.stream.write(
+            f"\r{Fore.BLUE}{self.label} [{'#' * filled}{'.' * (self.width - filled)}]"
+            f" {self.count}/{self.total} ({rate:.0f}/s){Style.RESET_ALL}"
+        )
+        self.stream.flush()
+
+    def close(self):
+        self.draw()
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+
+
+class SortProgress(ProgressBar):
+    """Progress and statistics of a sort: rates, ETA, counts per category.
+
+    The totals grow as plans are added, and phase() times the scan, classify
+    and move phases. With live=False nothing is drawn and only the summary
+    is kept; with json_lines=True each redraw is a JSON object on its own
+    line, for monitoring tools. Updates may come from several threads, and
+    are forwarded to ``parent`` when one is given, e.g. to show one line for
+    several directories sorted at the same time.
+    """
+
+    def __init__(
+        self,
+        label="",
+        live=True,
+        json_lines=False,
+        interval=0.5,
+        stream=None,
+        parent=None,
+    ):
+        super().__init__(0, label, interval, stream=stream)
+        self.live = live
+        self.json_lines = json_lines
+        self.parent = parent
+        self.total_bytes = 0
+        self.bytes = 0
+        self.categories = Counter()
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if is_enabled():
+                record(f"phase {name}", elapsed)
+
+    def add(self, count, size):
+        """Add count planned moves totalling size bytes."""
+        with self._lock:
+            self.total += count
+            self.total_bytes += size
+        if self.parent is not None:
+            self.parent.add(count, size)
+
+    def update(self, count=1, size=0, category=None):
+        with self._lock:
+            self.bytes += size
+            if category is not None:
+                self.categories[category] += count
+            if self.live:
+                super().update(count)
+            else:
+                self.count += count
+        if self.parent is not None:
+            self.parent.update(count, size, category)
+
+    def summary(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.count
+        return {
+            "label": self.label,
+            "files": self.count,
+            "total": self.total,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "seconds": round(elapsed, 3),
+            "files_per_second": round(rate, 1),
+            "bytes_per_second": round(self.bytes / elapsed if elapsed > 0 else 0.0),
+            "eta_seconds": round(remaining / rate, 1) if rate > 0 else None,
+            "categories": dict(self.categories.most_common()),
+            "phases": {name: round(value, 3) for name, value in self.phases.items()},
+        }
+
+    def draw(self, now=None):
+        state = self.summary(now)
+        if self.json_lines:
+            self.stream.write(json.dumps(state) + "\n")
+            self.stream.flush()
+            return
+        fraction = min(1.0, self.count / self.total) if self.total else 1.0
+        filled = int(self.width * fraction)
+        eta = state["eta_seconds"]
+        top = ", ".join(
+            f"{category} {count}" for category, count in self.categories.most_common(3)
+        )
+        self.stream.write(
+            f"\r{Fore.BLUE}{self.label} [{'#' * filled}{'.' * (self.width - filled)}]"
+            f" {self.count}/{self.total}"
+            f" {state['files_per_second']:.0f} files/s"
+            f" {format_bytes(state['bytes_per_second'])}/s"
+            f" ETA {format_duration(eta) if eta is not None else '-'}"
+            f"{' | ' + top if top else ''}{Style.RESET_ALL}"
+        )
+        self.stream.flush()
+
+    def close(self):
+        if not self.live:
+            return
+        if self.json_lines:
+            self.draw()
+        else:
+            super().close()
+
+    def format_summary(self):
+        state = self.summary()
+        phases = ", ".join(
+            f"{name} {seconds:.2f}s" for name, seconds in state["phases"].items()
+        )
+        return (
+            f"{self.label}: {state['files']} entries, {format_bytes(state['bytes'])} "
+            f"moved in {state['seconds']:.2f}s ({phases}), "
+            f"{state['files_per_second']:.0f} files/s, "
+            f"{format_bytes(state['bytes_per_second'])}/s"
+        )
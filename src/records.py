@@ -0,0 +1,168 @@
+import os
+from array import array
+from collections import namedtuple
+from collections.abc import Sequence
+
+# One planned move. Paths are plain strings; size is 0 for folders, which
+# are not walked twice.
+PlannedMove = namedtuple("PlannedMove", "source destination size category kind")
+KINDS = ("file", "folder")
+
+
+class MoveRecords(Sequence):
+    """Compact sequence of PlannedMove, stored column by column.
+
+    Directories and categories are interned in small tables and referenced
+    by id from typed arrays, so a move costs its basename and a dozen bytes
+    instead of a tuple holding two full paths. The destination name is only
+    stored when it differs from the source name (renamed collisions).
+    Indexing and iterating rebuild PlannedMove tuples on the fly; the
+    accessors below read a single field without building one. Records are
+    read-only once built, like the MovePlan holding them.
+    """
+
+    __slots__ = (
+        "_directories",
+        "_directory_ids",
+        "_categories",
+        "_category_ids",
+        "_sources",
+        "_targets",
+        "_names",
+        "_renamed",
+        "_sizes",
+        "_category_column",
+        "_kinds",
+    )
+
+    def __init__(self, moves=()):
+        self._directories = []
+        self._directory_ids = {}
+        self._categories = []
+        self._category_ids = {}
+        self._sources = array("I")  # Directory id of each source
+        self._targets = array("I")  # Directory id of each destination
+        self._names = []
+        self._renamed = {}  # Position -> destination name, when it differs
+        self._sizes = array("q")
+        self._category_column = array("H")
+        self._kinds = array("B")
+        for move in moves:
+            self._append(move)
+
+    def _directory_id(self, directory):
+        directory_id = self._directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self._directory_ids[directory] = len(self._directories)
+            self._directories.append(directory)
+        return directory_id
+
+    def _append(self, move):
+        source_directory, name = os.path.split(move.source)
+        target_directory, target_name = os.path.split(move.destination)
+        if target_name != name:
+            self._renamed[len(self._names)] = target_name
+        category_id = self._category_ids.get(move.category)
+        if category_id is None:
+            category_id = self._category_ids[move.category] = len(self._categories)
+            self._categories.append(move.category)
+        self._sources.append(self._directory_id(source_directory))
+        self._targets.append(self._directory_id(target_directory))
+        self._names.append(name)
+        self._sizes.append(move.size)
+        self._category_column.append(category_id)
+        self._kinds.append(KINDS.index(move.kind))
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        return PlannedMove(
+            self.source(position),
+            self.destination(position),
+            self._sizes[position],
+            self.category(position),
+            self.kind(position),
+        )
+
+    def name(self, position):
+        return self._names[position]
+
+    def source_directory(self, position):
+        return self._directories[self._sources[position]]
+
+    def source(self, position):
+        return os.path.join(self.source_directory(position), self._names[position])
+
+    def target_directory(self, position):
+        return self._directories[self._targets[position]]
+
+    def destination(self, position):
+        name = self._renamed.get(position, self._names[position])
+        return os.path.join(self.target_directory(position), name)
+
+    def size(self, position):
+        return self._sizes[position]
+
+    def category(self, position):
+        return self._categories[self._category_column[position]]
+
+    def kind(self, position):
+        return KINDS[self._kinds[position]]
+
+    def total_size(self):
+        return sum(self._sizes)
+
+    def ordered(self):
+        """Return the positions in the order the moves run: files first,
+        then grouped by target directory, small entries first."""
+        return array(
+            "I",
+            sorted(
+                range(len(self)),
+                key=lambda position: (
+                    self._kinds[position],
+                    self._directories[self._targets[position]],
+                    self._sizes[position],
+                ),
+            ),
+        )
+
+
+class PlanMoves(Sequence):
+    """(source, destination, original_location) of some moves of a plan.
+
+    Built on access from MoveRecords positions, for run_moves. The original
+    location is the source seen from the resolved directory of the plan,
+    which is what the undo journal records.
+    """
+
+    __slots__ = ("records", "positions", "directory", "origin")
+
+    def __init__(self, records, positions, directory, origin):
+        self.records = records
+        self.positions = positions
+        self.directory = directory
+        self.origin = origin
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        position = self.positions[index]
+        records = self.records
+        source = records.source(position)
+        source_directory = records.source_directory(position)
+        if source_directory == self.directory:
+            original_location = os.path.join(self.origin, records.name(position))
+        else:  # Deep sorts move entries of subfolders
+            original_location = os.path.join(
+                self.origin, os.path.relpath(source, self.directory)
+            )
+        return source, records.destination(position), original_location
@@ -0,0 +1,51 @@
+import json
+import os
+import time
+
+RUN_REPORT_FILE = "User_Files/sort_runs.jsonl"
+# Shared by the records of one invocation, like the sessions of the journal
+RUN_ID = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+
+def run_record(
+    directory, scanned=0, planned=0, moved=0, progress=None, unchanged=False, **extra
+):
+    """Return the result record of sorting one directory.
+
+    ``scanned`` entries were listed, ``planned`` of them were to be moved
+    and ``moved`` were. The others were skipped: settled since the last
+    sort, duplicates or names already taken. ``progress`` is the
+    SortProgress of the sort, for the bytes, categories and timings.
+    ``unchanged`` directories were skipped as a whole by the index.
+    ``extra`` is added as is, e.g. the error of a failed directory.
+    """
+    record = {
+        "run": RUN_ID,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "directory": str(directory),
+        "scanned": scanned,
+        "moved": moved,
+        "skipped": scanned - planned,
+        "failed": planned - moved,
+        "unchanged": unchanged,
+    }
+    if progress is not None:
+        state = progress.summary()
+        record.update(
+            bytes=state["bytes"],
+            categories=state["categories"],
+            seconds=state["seconds"],
+            phases=state["phases"],
+        )
+    record.update(extra)
+    return record
+
+
+def write_run_records(records, path=None):
+    """Append records to the JSON-lines run report, in a single write."""
+    if not records:
+        return
+    path = path or RUN_REPORT_FILE
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
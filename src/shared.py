@@ -1,4 +1,18 @@
 # src/shared.py
+import atexit
+import threading
+from collections import Counter
+from .journal import UndoJournal
 
-# Create an empty stack to store undo operations
-undo_stack = []
+# Journal of the moves to undo, kept on disk (see journal.py)
+undo_stack = UndoJournal()
+atexit.register(undo_stack.sync)
+
+# Count the filesystem calls issued by the last sort run
+fs_calls = Counter()
+_fs_calls_lock = threading.Lock()  # Sorts run their calls on several threads
+
+
+def count_fs_call(name, count=1):
+    with _fs_calls_lock:
+        fs_calls[name] += count
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from .logger import log_message
+from .shared import count_fs_call
+
+SNIFF_CACHE_FILE = "User_Files/sniff_cache.json"
+SNIFF_CACHE_MAX_ENTRIES = 100000
+SNIFF_BYTES = 512  # Only the start of a file is ever read
+
+# (offset, magic bytes, extension), the extension being looked up in the
+# loaded extension maps to find the category. Longer signatures come first.
+MAGIC_NUMBERS = (
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"\xff\xd8\xff", ".jpg"),
+    (0, b"GIF87a", ".gif"),
+    (0, b"GIF89a", ".gif"),
+    (4, b"ftypheic", ".heic"),
+    (4, b"ftypheix", ".heic"),
+    (4, b"ftypmif1", ".heic"),
+    (4, b"ftypM4A", ".m4a"),
+    (4, b"ftypqt", ".mov"),
+    (4, b"ftyp", ".mp4"),
+    (0, b"\x1a\x45\xdf\xa3", ".mkv"),
+    (0, b"\x30\x26\xb2\x75\x8e\x66\xcf\x11", ".wmv"),
+    (8, b"AVI ", ".avi"),
+    (8, b"WAVE", ".wav"),
+    (8, b"AIFF", ".aiff"),
+    (0, b"fLaC", ".flac"),
+    (0, b"OggS", ".ogg"),
+    (0, b"MAC ", ".ape"),
+    (0, b"ID3", ".mp3"),
+    (0, b"\xff\xfb", ".mp3"),
+    (0, b"\xff\xf3", ".mp3"),
+    (0, b"\xff\xf2", ".mp3"),
+    (0, b"%PDF-", ".pdf"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", ".doc"),
+    (0, b"PK\x03\x04", ".zip"),
+    (0, b"!<arch>\ndebian", ".deb"),
+    (0, b"\xed\xab\xee\xdb", ".rpm"),
+    (0, b"\x7fELF", ".bin"),
+    (0, b"MZ", ".exe"),
+    (0, b"#!", ".sh"),
+    (0, b"BM", ".bmp"),
+    (0, b"<svg", ".svg"),
+)
+
+
+def sniff_bytes(head):
+    """Return the extension matching the first bytes of a file, or ""."""
+    for offset, magic, extension in MAGIC_NUMBERS:
+        if head.startswith(magic, offset):
+            return extension
+    if head and b"\0" not in head:
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut by the end of the sample is fine
+            if e.start < len(head) - 3:
+                return ""
+        return ".txt"
+    return ""
+
+
+class Sniffer:
+    """Guess the extension of files from their content, with a result cache.
+
+    Results are cached on disk by (device, inode, size, mtime), so a file is
+    read at most once until it changes.
+    """
+
+    def __init__(self, path=SNIFF_CACHE_FILE, max_entries=SNIFF_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.hits = self.misses = 0
+        self.dirty = False
+        self._lock = threading.Lock()  # Directories may be sorted concurrently
+        try:
+            with open(self.path, "r") as f:
+                self.results = OrderedDict(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            log_message("warning", f"Ignoring unreadable sniff cache: {e}")
+
+    def sniff(self, path, stat=None):
+        """Return the extension path looks like, e.g. ".png", or ""."""
+        if stat is None:
+            count_fs_call("stat")
+            stat = os.stat(path)
+        key = f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+        with self._lock:
+            extension = self.results.get(key)
+            if extension is not None:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return extension
+            self.misses += 1
+        try:
+            count_fs_call("read")
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            try:
+                head = os.read(fd, SNIFF_BYTES)
+            finally:
+                os.close(fd)
+        except OSError:
+            return ""  # Unreadable files are not cached, they may become readable
+        extension = sniff_bytes(head)
+        with self._lock:
+            self.results[key] = extension
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+            self.dirty = True
+        return extension
+
+    def save(self):
+        with self._lock:
+            if self.dirty:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "w") as f:
+                    json.dump(self.results, f)
+                self.dirty = False
+        log_message("info", f"Sniff cache: {self.hits} hits, {self.misses} misses")
+
+
+_sniffer = None
+_sniffer_lock = threading.Lock()
+
+
+def get_sniffer():  # Load the persistent cache on first use
+    global _sniffer
+    with _sniffer_lock:
+        if _sniffer is None:
+            _sniffer = Sniffer()
+    return _sniffer
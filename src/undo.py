@@ -1,41 +1,146 @@
-# Create an empty stack to store undo operations
+# Revert the moves recorded in the undo journal
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from .logger import log_message
 from .language import messages
 from colorama import Fore, Style
+from .mover import fast_move
+from .progress import ProgressBar
 from .shared import undo_stack
 
+UNDO_WORKERS = 8  # Threads restoring the moves of one batch
+UNDO_BATCH_SIZE = 1024  # Largest number of moves restored in parallel at once
 
-def undo_all_operations():  # Function to undo all operations
-    if not undo_stack:
+
+def undo_all_operations(workers=UNDO_WORKERS):  # Function to undo all operations
+    return undo_latest_session(workers)["undone"]
+
+
+def undo_latest_session(workers=UNDO_WORKERS):
+    # Revert every move of the latest session, newest first. The journal is
+    # read backwards in blocks, so even huge sessions are never fully loaded.
+    # Returns the number of moves undone, missing and failed; failed moves
+    # stay in the journal so that the next undo retries them.
+    results = {"undone": 0, "missing": 0, "failed": 0}
+    session = undo_stack.latest_session()
+    if session is None:
         print(f"{Fore.BLUE}{'-' * 100}{Style.RESET_ALL}")
         print(
             f"{Fore.YELLOW}{'There is no operation to cancel.'.center(100)}{Style.RESET_ALL}"
         )
         log_message("info", messages["no_operation_to_cancel"])
-        return
-    while undo_stack:
-        undo_last_operation()
+        return results
+    start = time.perf_counter()
+    total = sum(1 for _ in undo_stack.iter_reverse(session))
+    progress = ProgressBar(total, "Undo")
+    emptied = set()  # Folders the moves were taken out of
+    failed = []  # Journal offsets of the moves to keep for a later undo
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for batch in _conflict_free_batches(undo_stack.iter_reverse(session)):
+            for (offset, src, _), outcome in zip(
+                batch, executor.map(lambda move: _restore(*move[1:]), batch)
+            ):
+                results[outcome] += 1
+                if outcome == "undone":
+                    emptied.add(os.path.dirname(src))
+                elif outcome == "failed":
+                    failed.append(offset)
+            progress.update(len(batch))
+    progress.close()
+    undo_stack.drop_session(session, keep=failed)
+    removed = _remove_empty_folders(emptied)
+
+    summary = (
+        f"Undone {results['undone']} of {total} moves "
+        f"({results['missing']} missing, {results['failed']} failed), "
+        f"removed {removed} empty folders in {time.perf_counter() - start:.2f}s"
+    )
+    print(f"{Fore.BLUE}{'-' * 100}{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}{summary.center(100)}{Style.RESET_ALL}")
+    log_message("info", summary)
+    return results
+
+
+def _conflict_free_batches(records):
+    # Group consecutive moves into batches whose paths never overlap, so the
+    # moves of a batch can run in any order. A move touching a path, or a
+    # parent or child of a path, already used in the batch starts a new one:
+    # e.g. a file is restored before the folder it came from is moved back.
+    batch, touched, parents = [], set(), set()
+    for offset, _, src, dst in records:
+        paths = (os.fspath(src), os.fspath(dst))
+        ancestors = {parent for path in paths for parent in _ancestors(path)}
+        if batch and (
+            len(batch) >= UNDO_BATCH_SIZE
+            or any(path in touched or path in parents for path in paths)
+            or not touched.isdisjoint(ancestors)
+        ):
+            yield batch
+            batch, touched, parents = [], set(), set()
+        batch.append((offset, src, dst))
+        touched.update(paths)
+        parents.update(ancestors)
+    if batch:
+        yield batch
+
+
+def _ancestors(path):
+    parent = os.path.dirname(path)
+    while parent and parent != path:
+        yield parent
+        path, parent = parent, os.path.dirname(parent)
+
+
+def _restore(src, dst):
+    # Move src back to dst, recreating the folder it was taken from if needed
+    if not os.path.lexists(src):
+        return "missing"
+    try:
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        fast_move(src, dst)
+    except OSError as e:
+        log_message("error", messages["error_moving"].format(file=src, error=e))
+        return "failed"
+    return "undone"
+
+
+def _remove_empty_folders(folders):
+    # Category folders emptied by the undo are removed, deepest first
+    removed = 0
+    for folder in sorted(folders, key=len, reverse=True):
+        try:
+            os.rmdir(folder)
+            removed += 1
+        except OSError:
+            pass  # Not empty or already gone
+    return removed
 
 
 def undo_last_operation():  # Function to undo the last operation
     if undo_stack:
         src, dst = undo_stack.pop()
-        if os.path.exists(src):  # Check if the source file exists
-            shutil.move(src, dst)
-            print(
-                f"{Fore.GREEN}{'Successfully moved ' + str(src) + ' back to ' + str(dst).center(100)}{Style.RESET_ALL}"
-            )  # Print a success message in green
-            print(f"{Fore.BLUE}{'-' * 100}{Style.RESET_ALL}")
-            log_message("info", messages["moved"].format(src=src, dst=dst))
-        else:
-            print(
-                f"{Fore.RED}{'File ' + src + ' does not exist.'.center(100)}{Style.RESET_ALL}"
-            )  # Print an error message in red
-            log_message("error", messages["file_does_not_exist"].format(src=src))
+        undo_move(src, dst)
     else:
         print(
             f"{Fore.YELLOW}{messages['no_operation_to_cancel'].center(100)}{Style.RESET_ALL}"
         )  # Print a warning message in yellow
         log_message("info", messages["no_operation_to_cancel"])
+
+
+def undo_move(src, dst):  # Move src back to dst, return 1 if it was moved
+    if os.path.exists(src):  # Check if the source file exists
+        shutil.move(src, dst)
+        print(
+            f"{Fore.GREEN}{'Successfully moved ' + str(src) + ' back to ' + str(dst).center(100)}{Style.RESET_ALL}"
+        )  # Print a success message in green
+        print(f"{Fore.BLUE}{'-' * 100}{Style.RESET_ALL}")
+        log_message("info", messages["moved"].format(src=src, dst=dst))
+        return 1
+    print(
+        f"{Fore.RED}{'File ' + str(src) + ' does not exist.'.center(100)}{Style.RESET_ALL}"
+    )  # Print an error message in red
+    log_message("error", messages["file_does_not_exist"].format(src=src))
+    return 0
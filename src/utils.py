@@ -2,11 +2,22 @@ import os
 import json
 from pathlib import Path
 from colorama import Fore, Style
-from .shared import undo_stack  # Updated import from shared.py
-from .language import messages, os_language, LANGUAGE_FUNCTIONS
-from .logger import log_message
-from collections import Counter
-import shutil
+from .shared import undo_stack, fs_calls, count_fs_call  # Updated import from shared.py
+from .language import messages, directories_name, get_language_functions
+from .logger import LOG_FILE, log_message
+from .mover import fast_move, clear_device_cache
+from .cache import get_folder_cache
+from .classifier import get_classifier
+from .sniffer import get_sniffer
+from .dedup import dedup_plan, link_duplicates
+from .collisions import resolve_collisions
+from .index import get_sort_index, index_config, known_names
+from .progress import SortProgress
+from .records import MoveRecords, PlanMoves, PlannedMove
+from .report import run_record, write_run_records
+from array import array
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from .constants import (
     EXTENSIONS_PERSONNALISER,
     EXTENSIONS_DOCUMENT,
@@ -15,43 +26,146 @@ from .constants import (
     EXTENSIONS_MUSIC,
     EXTENSIONS_VIDEO,
     EXTENSIONS_ALL,
+    DUPLICATES_FOLDER,
     extension_dicts,
 )
 
+MOVES_IN_FLIGHT_PER_WORKER = 4  # Moves queued on the pool per worker thread
 
-language_functions = LANGUAGE_FUNCTIONS.get(os_language, LANGUAGE_FUNCTIONS["en"])
 
-
-def get_folder_category(folder_path, extensions):
-    file_types = []
+def get_folder_category(
+    folder_path,
+    extensions,
+    max_files=None,
+    max_depth=None,
+    early_exit=True,
+    cache=None,
+):
+    """Return the most common category of the files under folder_path.
+
+    The walk can be bounded: ``max_files`` caps how many files are looked
+    at, ``max_depth`` how many levels below folder_path are visited (0 means
+    only its own files). With a file budget, ``early_exit`` stops as soon as
+    the leading category can no longer be overtaken. Without limits the
+    result is the same as counting every file.
+
+    When a FolderCategoryCache is given, unchanged folders are answered from
+    it and complete walks are stored in it. Classifiers with name rules need
+    the file names themselves and do not use the cache.
+    """
+    classifier = get_classifier(extensions)
+    if classifier.rules:
+        cache = None
+    if cache is not None:
+        counts = cache.lookup(folder_path, classifier.signature)
+        if counts is not None:
+            return _category_from_counts(counts, classifier)
+    categories = Counter()
+    ext_counts = Counter() if cache is not None else None
+    mtimes = {} if cache is not None else None
+    seen = 0
+    complete = True
 
     # Traverse through the folder to identify file types
-    for root, _, files in os.walk(folder_path):
+    for root, files in _walk_tree(folder_path, max_depth, mtimes):
         for file in files:
-            _, ext = os.path.splitext(file)
-            ext = (
-                ext.lower().strip()
-            )  # Normalize extension: lowercase and strip whitespace
-            if ext in extensions:
-                file_types.append(extensions[ext])
+            if max_files is not None and seen >= max_files:
+                break
+            seen += 1
+            ext, category = classifier.match(file)
+            if ext_counts is not None:
+                ext_counts[ext] += 1
+            if category is not None:
+                categories[category] += 1
+            if early_exit and max_files is not None and not seen % 1024:
+                if _has_unassailable_lead(categories, max_files - seen):
+                    seen = max_files  # Nothing left can change the result
+                    break
+        if max_files is not None:
+            if seen >= max_files:
+                complete = False
+                break
+            if early_exit and _has_unassailable_lead(categories, max_files - seen):
+                complete = False
+                break
+
+    if cache is not None and complete and max_depth is None:
+        root_stat = mtimes.pop(os.fspath(folder_path), None)
+        if root_stat is not None:
+            directories = {".": root_stat.st_mtime_ns}
+            for path, stat in mtimes.items():
+                directories[os.path.relpath(path, folder_path)] = stat.st_mtime_ns
+            cache.store(
+                folder_path,
+                root_stat.st_ino,
+                directories,
+                dict(ext_counts),
+                classifier.signature,
+            )
 
     # Determine the most common category in the folder
-    if file_types:
-        most_common_category = Counter(file_types).most_common(1)[0][0]
+    if categories:
+        # Ties go to the category seen first, as with the former list count
+        most_common_category = categories.most_common(1)[0][0]
         return most_common_category
     else:
         return "Divers"  # Fallback if no known file types are found
 
 
+def _walk_tree(top, max_depth=None, stats=None):
+    # Top-down walk in the same order as os.walk, yielding (root, file names).
+    # When stats is a dict, each directory is stat-ed before it is listed so
+    # that a change made during the walk shows up as a newer mtime.
+    stack = [(os.fspath(top), 0)]
+    while stack:
+        root, depth = stack.pop()
+        try:
+            if stats is not None:
+                count_fs_call("stat")
+                stats[root] = os.stat(root)
+            count_fs_call("scandir")
+            with os.scandir(root) as entries:
+                files, subdirs = [], []
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        files.append(entry.name)
+                    elif not entry.is_symlink():
+                        subdirs.append(entry.path)
+        except OSError:
+            continue
+        yield root, files
+        if max_depth is None or depth < max_depth:
+            stack.extend((path, depth + 1) for path in reversed(subdirs))
+
+
+def _category_from_counts(counts, classifier):
+    # Rebuild the category counts in first-seen order from cached counts
+    categories = Counter()
+    for ext, count in counts.items():
+        category = classifier.table.get(ext)
+        if category is not None:
+            categories[category] += count
+    if categories:
+        return categories.most_common(1)[0][0]
+    return "Divers"
+
+
+def _has_unassailable_lead(categories, remaining):
+    if not categories:
+        return False
+    leader, runner_up = (categories.most_common(2) + [(None, 0)])[:2]
+    return leader[1] - runner_up[1] > remaining
+
 
 def move_file(file, target_directory):
     try:
         target_directory.mkdir(parents=True, exist_ok=True)
         original_location = file.resolve()
-        shutil.move(str(file), str(target_directory / file.name))
-        undo_stack.append(
-            (target_directory / file.name, original_location)
-        )  # Track the operation
+        _move_entry(file, target_directory, original_location)
     except Exception as e:
         print(f"Exception when moving file: {e}")
 
@@ -60,45 +174,362 @@ def move_folder(folder, target_directory):
     try:
         target_directory.mkdir(parents=True, exist_ok=True)
         original_location = folder.resolve()
-        shutil.move(str(folder), str(target_directory / folder.name))
-        undo_stack.append(
-            (target_directory / folder.name, original_location)
-        )  # Track the operation
+        _move_entry(folder, target_directory, original_location)
     except Exception as e:
         print(f"Exception when moving folder: {e}")
 
 
-def sort_directory(directory, extensions):
-    sorted_folders = set()
+def _move_entry(source, target_directory, original_location):
+    # Move an entry into a target directory that is known to exist
+    destination = target_directory / source.name
+    fast_move(source, destination)  # Rename when possible, copy across devices
+    undo_stack.append((destination, original_location))  # Track the operation
 
-    if not directory.exists():
-        return False, sorted_folders
+
+def _try_move(move):
+    # Worker side of a move: journal the undo entry as soon as the move
+    # succeeds, so a crash never leaves a moved entry without one, and
+    # report the error instead of raising it
+    source, destination, original_location = move
+    try:
+        fast_move(source, destination)
+    except Exception as e:
+        return e
+    undo_stack.append((destination, original_location))  # Track it
+    return None
+
+
+def _bounded_map(function, items, workers):
+    # Yield (position, result) as the calls complete, with at most
+    # MOVES_IN_FLIGHT_PER_WORKER calls per worker submitted at once, so the
+    # pool never holds the whole list of moves
+    window = workers * MOVES_IN_FLIGHT_PER_WORKER
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for position, item in enumerate(items):
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[executor.submit(function, item)] = position
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def run_moves(moves, workers=1, kind="file", on_moved=None):
+    """Apply (source, destination, original_location) moves.
+
+    With more than one worker the moves run on a thread pool, a few per
+    worker at a time, and complete in any order; alone they run in order.
+    Each undo entry is recorded as soon as its move succeeds. ``on_moved``
+    is called with the position of each move that succeeded. Returns the
+    number of entries that were moved.
+    """
+    if workers > 1 and len(moves) > 1:
+        results = _bounded_map(_try_move, moves, workers)
+    else:
+        results = enumerate(map(_try_move, moves))
+    moved = 0
+    for position, error in results:
+        if error is None:
+            moved += 1
+            if on_moved is not None:
+                on_moved(position)
+        else:
+            print(f"Exception when moving {kind}: {error}")
+    return moved
+
+
+def _ensure_directory(directory, created):
+    # Create each target directory at most once per run
+    if directory not in created:
+        count_fs_call("mkdir")
+        os.makedirs(directory, exist_ok=True)
+        created.add(directory)
+
+
+def scan_directory(directory):
+    """Split the entries of a directory into files and folders in one pass."""
+    files, folders = [], []
+    count_fs_call("scandir")
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # DirEntry caches the type from the directory listing, so only
+            # symlinks and filesystems without d_type cost an extra stat
+            if entry.is_file():
+                files.append(entry)
+            elif entry.is_dir():
+                folders.append(entry)
+    return files, folders
+
+
+# An immutable plan: the directory as given, its resolved path (used for the
+# undo entries) and the moves, files first then folders, as MoveRecords
+MovePlan = namedtuple("MovePlan", "directory origin moves")
+
+
+def build_plan(
+    directory,
+    extensions,
+    folder_budget=None,
+    use_folder_cache=True,
+    sniff=False,
+    collisions="rename",
+    only=None,
+):
+    """Decide where every entry of directory goes without touching anything.
+
+    With sniff, files whose extension is unknown are classified from their
+    first bytes instead of going straight to the default folder. Names
+    already taken in a target folder are handled by the ``collisions``
+    policy of resolve_collisions. ``only`` limits the plan to the entries
+    with these names, e.g. the new arrivals seen by watch mode.
+    """
+    files, folders = scan_directory(directory)
+    if only is not None:
+        files = [entry for entry in files if entry.name in only]
+        folders = [entry for entry in folders if entry.name in only]
+    return plan_entries(
+        directory,
+        files,
+        folders,
+        extensions,
+        folder_budget,
+        use_folder_cache,
+        sniff,
+        collisions,
+    )
+
+
+def plan_entries(
+    directory,
+    files,
+    folders,
+    extensions,
+    folder_budget=None,
+    use_folder_cache=True,
+    sniff=False,
+    collisions="rename",
+):
+    """Plan the moves of the DirEntry lists returned by scan_directory."""
+    directory = os.fspath(directory)
+    classifier = get_classifier(extensions)  # Built once per extension map
+    sniffer = get_sniffer() if sniff else None
+    moves = []
 
     # Sort individual files first
-    files = [f for f in directory.iterdir() if f.is_file()]
-    for file in files:
-        dossier_cible = extensions.get(file.suffix.lower(), "Divers")
-        dossier_cible_absolu = directory / dossier_cible
-        move_file(file, dossier_cible_absolu)
-        sorted_folders.add(str(dossier_cible_absolu))
-
-    # Now sort folders based on their individual contents
-    folders = [f for f in directory.iterdir() if f.is_dir()]
-    for folder in folders:
+    for entry in files:
+        dossier_cible = classifier.match(entry.name)[1]
+        try:
+            count_fs_call("stat")
+            stat = entry.stat()
+            size = stat.st_size
+        except OSError:
+            stat, size = None, 0
+        if dossier_cible is None and sniffer is not None and stat is not None:
+            dossier_cible = classifier.table.get(sniffer.sniff(entry.path, stat))
+        if dossier_cible is None:
+            dossier_cible = classifier.default
+        destination = os.path.join(directory, dossier_cible, entry.name)
+        moves.append(PlannedMove(entry.path, destination, size, dossier_cible, "file"))
+
+    # Now sort folders based on their individual contents. Category folders
+    # only hold files of their own category, so they end up skipped below.
+    cache = get_folder_cache() if use_folder_cache else None
+    for entry in folders:
+        if entry.name == DUPLICATES_FOLDER:
+            continue  # Set aside by the dedup stage, left where it is
         # Analyze the folder independently
-        category = get_folder_category(folder, extensions)
-        target_directory = directory / category
+        category = get_folder_category(
+            entry.path, classifier, cache=cache, **(folder_budget or {})
+        )
+        target_directory = os.path.join(directory, category)
 
         # Prevent moving a folder into itself or its own subfolder
-        if not str(target_directory).startswith(str(folder)):
-            move_folder(folder, target_directory)
-            sorted_folders.add(str(target_directory))
+        if not target_directory.startswith(entry.path):
+            destination = os.path.join(target_directory, entry.name)
+            moves.append(PlannedMove(entry.path, destination, 0, category, "folder"))
+    if cache is not None:
+        cache.save()
+    if sniffer is not None:
+        sniffer.save()
+
+    moves = MoveRecords(resolve_collisions(moves, collisions))
+    return MovePlan(directory, os.path.realpath(directory), moves)
+
+
+def execute_plan(plan, workers=1, optimize=True, progress=None):
+    """Apply a MovePlan and return (moved_count, sorted_folders).
+
+    progress is an optional SortProgress updated as entries are moved.
+    """
+    records = plan.moves
+    if not isinstance(records, MoveRecords):
+        records = MoveRecords(records)
+    order = records.ordered() if optimize else range(len(records))
+    sorted_folders = set()
+    created = set()
+    # Positions in records; the paths are only built when each move runs
+    batches = {"file": array("I"), "folder": array("I")}
+    for position in order:
+        target_directory = records.target_directory(position)
+        try:
+            _ensure_directory(target_directory, created)
+        except Exception as e:
+            print(f"Exception when moving {records.kind(position)}: {e}")
+            continue
+        batches[records.kind(position)].append(position)
+        sorted_folders.add(target_directory)
+    moved = 0
+    if progress is not None:
+        progress.add(len(records), records.total_size())
+    for kind, positions in batches.items():
+        on_moved = None
+        if progress is not None:
+
+            def on_moved(index, positions=positions):
+                position = positions[index]
+                progress.update(1, records.size(position), records.category(position))
+
+        moves = PlanMoves(records, positions, plan.directory, plan.origin)
+        moved += run_moves(moves, workers, kind, on_moved)
+    undo_stack.sync()  # The whole plan is on disk before returning
+    return moved, sorted_folders
+
+
+def print_plan(plan):
+    for move in plan.moves:
+        print(
+            Fore.BLUE
+            + f"{move.source} -> {move.destination}"
+            + Style.RESET_ALL
+            + f" ({move.category}, {move.size} bytes)"
+        )
+    files = sum(1 for move in plan.moves if move.kind == "file")
+    print(Fore.BLUE + "-" * 100 + Style.RESET_ALL)
+    print(
+        Fore.GREEN
+        + f"{files} files and {len(plan.moves) - files} folders would be moved "
+        f"({sum(move.size for move in plan.moves)} bytes)".center(100) + Style.RESET_ALL
+    )
 
-    return True, sorted_folders
+
+def export_plan(plan, path):
+    # JSON lines: a header with the directories, then one move per line
+    with open(path, "w") as f:
+        f.write(json.dumps({"directory": plan.directory, "origin": plan.origin}))
+        f.write("\n")
+        for move in plan.moves:
+            f.write(json.dumps(move._asdict()))
+            f.write("\n")
+
+
+def load_plan(path):
+    with open(path, "r") as f:
+        header = json.loads(f.readline())
+        moves = MoveRecords(
+            PlannedMove(**json.loads(line)) for line in f if line.strip()
+        )
+    return MovePlan(header["directory"], header["origin"], moves)
+
+
+def sort_directory(
+    directory,
+    extensions,
+    workers=1,
+    folder_budget=None,
+    use_folder_cache=True,
+    sniff=False,
+    dedup=None,
+    collisions="rename",
+    incremental=True,
+    progress=None,
+):
+    """Sort directory and return (moved_any, sorted_folders).
+
+    moved_any is False when nothing was moved, e.g. the directory is
+    missing or already sorted. The counts of the run are appended to the
+    run report (see run_record). dedup is None or one of the policies of
+    dedup_plan, applied to the plan before anything is moved. With
+    incremental, only the entries that are new or changed since the last
+    sort are planned (see SortIndex).
+    progress is an optional SortProgress, which also times the scan,
+    classify and move phases; a silent one is used otherwise.
+    """
+    sorted_folders = set()
+    if progress is None:
+        progress = SortProgress(str(directory), live=False)
+
+    if not directory.exists():
+        write_run_records([run_record(directory, error="directory does not exist")])
+        return False, sorted_folders
+
+    fs_calls.clear()
+    clear_device_cache()
+    index = get_sort_index() if incremental else None
+    config = index_config(
+        extensions,
+        folder_budget=folder_budget,
+        sniff=sniff,
+        dedup=dedup,
+        collisions=collisions,
+    )
+    with progress.phase("scan"):
+        if index is not None and index.unchanged(directory, config):
+            log_message("info", f"{directory} unchanged since its last sort")
+            write_run_records(
+                [run_record(directory, progress=progress, unchanged=True)]
+            )
+            return False, sorted_folders
+        files, folders = scan_directory(directory)
+        changed_files, changed_folders = files, folders
+        if index is not None:
+            changed_files, changed_folders = index.changed_entries(
+                directory, config, files, folders
+            )
+    with progress.phase("classify"):
+        plan = plan_entries(
+            directory,
+            changed_files,
+            changed_folders,
+            extensions,
+            folder_budget,
+            use_folder_cache,
+            sniff,
+            collisions,
+        )
+        if dedup is not None:
+            plan, report = dedup_plan(plan, dedup)
+            if dedup == "hardlink":
+                link_duplicates(report)
+    with progress.phase("move"):
+        moved, sorted_folders = execute_plan(plan, workers, progress=progress)
+        if index is not None:
+            index.record(directory, config, known_names(plan, files, folders))
+    progress.close()
+
+    log_message("info", format_fs_calls(directory))
+    log_message("info", progress.format_summary())
+    scanned = len(files) + len(folders)
+    write_run_records(
+        [run_record(directory, scanned, len(plan.moves), moved, progress)]
+    )
+    return moved > 0, sorted_folders
+
+
+def format_fs_calls(directory):
+    details = ", ".join(f"{name}={count}" for name, count in sorted(fs_calls.items()))
+    return f"Sorted {directory}: {sum(fs_calls.values())} filesystem calls ({details})"
 
 
 def clear_console():  # Function to clear the console
-    os.system("cls" if os.name == "nt" else "clear")
+    if os.name == "nt":
+        os.system("cls")
+    else:
+        # ANSI "erase display" and "cursor home", without a clear subprocess
+        print("\033[2J\033[H", end="", flush=True)
     log_message("info", messages["console_cleared"])
 
 
@@ -162,6 +593,7 @@ def ensure_extensions_file_exists():
 
 
 def modify_extensions():
+    language_functions = get_language_functions()
     while True:
         choice = input(language_functions["choose_extensions"].center(100))
         print(Fore.BLUE + "--" * 50 + Style.RESET_ALL)
@@ -335,13 +767,14 @@ def ensure_folder_paths_file_exists():
 
 
 def ensure_log_file_exists():
-    log_file = Path("User_Files/file_sorter.log")
+    log_file = Path(LOG_FILE)
     if not log_file.exists():
         log_file.parent.mkdir(parents=True, exist_ok=True)
         log_file.touch()
 
 
 def modify_folder_paths():
+    language_functions = get_language_functions()
     clear_console()
     while True:
         folder_paths = load_folder_paths_from_file()
@@ -451,6 +884,22 @@ def show_all_folder_paths():
         print(Fore.RED + "No folder paths found.".center(100) + Style.RESET_ALL)
 
 
+def get_sort_targets():
+    """Return the (directory, extensions) pairs sorted by "Sort all directories"."""
+    home = Path.home()
+    targets = [
+        (home / directories_name["Music"], EXTENSIONS_MUSIC),
+        (home / directories_name["Videos"], EXTENSIONS_VIDEO),
+        (home / directories_name["Images"], EXTENSIONS_IMAGE),
+        (home / directories_name["Downloads"], EXTENSIONS_DOWNLOAD),
+        (home / directories_name["Documents"], EXTENSIONS_DOCUMENT),
+    ]
+    for folder_path in load_folder_paths_from_file().values():
+        if Path(folder_path).is_dir():
+            targets.append((Path(folder_path), EXTENSIONS_ALL))
+    return targets
+
+
 def validate_folder_paths():
     folder_paths = load_folder_paths_from_file()
     for folder_name, folder_path in folder_paths.items():
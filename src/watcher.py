@@ -0,0 +1,234 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections import defaultdict
+from .classifier import get_classifier
+from .constants import (
+    DUPLICATES_FOLDER,
+    WATCH_POLL_SECONDS,
+    WATCH_SETTLE_SECONDS,
+)
+from .dedup import dedup_plan, link_duplicates
+from .logger import log_message
+from .shared import count_fs_call
+from .utils import build_plan, execute_plan
+
+# Names used by browsers and download tools while a file is being written;
+# the finished file shows up later under its real name
+PARTIAL_SUFFIXES = (".part", ".partial", ".crdownload", ".download", ".tmp", ".!ut")
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, length of the name
+
+
+class InotifyWatcher:
+    """Report the names created in or moved into directories (Linux only)."""
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # Watch descriptor -> directory
+        for directory in directories:
+            wd = self._add_watch(
+                self.fd,
+                os.fsencode(directory),
+                IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR,
+            )
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, os.strerror(error), directory)
+            self.watches[wd] = directory
+
+    def wait(self, timeout):
+        """Block up to timeout seconds; return a set of (directory, name).
+
+        A name of None means the whole directory has to be looked at again,
+        after the kernel queue overflowed.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        events = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.update(
+                        (directory, None) for directory in self.watches.values()
+                    )
+                elif wd in self.watches and not mask & IN_IGNORED and name:
+                    events.add((self.watches[wd], os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: compare the listings of directories whose mtime changed."""
+
+    def __init__(self, directories, interval=WATCH_POLL_SECONDS):
+        self.interval = interval
+        self.listings = {
+            directory: self._listing(directory) for directory in directories
+        }
+
+    @staticmethod
+    def _listing(directory):
+        try:
+            count_fs_call("stat")
+            mtime = os.stat(directory).st_mtime_ns
+            count_fs_call("scandir")
+            with os.scandir(directory) as entries:
+                return mtime, {entry.name for entry in entries}
+        except OSError:
+            return None, set()
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            events = set()
+            for directory, (mtime, names) in self.listings.items():
+                try:
+                    count_fs_call("stat")
+                    if os.stat(directory).st_mtime_ns == mtime:
+                        continue  # Nothing was added or removed
+                except OSError:
+                    continue
+                listing = self._listing(directory)
+                events.update((directory, name) for name in listing[1] - names)
+                self.listings[directory] = listing
+            if events:
+                return events
+            remaining = (
+                self.interval if deadline is None else deadline - time.monotonic()
+            )
+            if remaining <= 0:
+                return events
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+def open_watcher(directories, polling=False, interval=WATCH_POLL_SECONDS):
+    """Return an inotify watcher when available, a polling one otherwise."""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            # e.g. the inotify watch limit is reached, or libc lacks inotify
+            log_message("warning", f"inotify unavailable, polling instead: {e}")
+    return PollingWatcher(directories, interval)
+
+
+def _ignored_names(classifier):
+    # Category folders appear when the first entry of a category is sorted
+    return set(classifier.reverse) | {classifier.default, DUPLICATES_FOLDER}
+
+
+def watch_directories(
+    targets,
+    settle=WATCH_SETTLE_SECONDS,
+    interval=WATCH_POLL_SECONDS,
+    polling=False,
+    stop=None,
+    workers=1,
+    dedup=None,
+    **plan_options,
+):
+    """Sort the entries arriving in the target directories until stopped.
+
+    ``targets`` is a list of (directory, extensions). Only the new entries
+    are classified and moved, once their size and mtime have not changed for
+    ``settle`` seconds. ``stop`` is an optional threading.Event; without it
+    the loop runs until interrupted. ``dedup`` is a dedup_plan policy and
+    ``plan_options`` go to build_plan.
+    Returns {directory: moved_count}.
+    """
+    extensions = {os.fspath(directory): ext for directory, ext in targets}
+    ignored = {
+        directory: _ignored_names(get_classifier(ext))
+        for directory, ext in extensions.items()
+    }
+    moved = {directory: 0 for directory in extensions}
+    pending = {}  # (directory, name) -> ((size, mtime), time it was last seen changing)
+    watcher = open_watcher(list(extensions), polling, interval)
+    log_message(
+        "info", f"Watching {len(extensions)} directories with {type(watcher).__name__}"
+    )
+    try:
+        while stop is None or not stop.is_set():
+            # Sleep in the kernel while idle, wake up to check pending entries
+            events = watcher.wait(min(settle, interval) if pending else interval)
+            now = time.monotonic()
+            for directory, name in events:
+                if name is None:
+                    names = PollingWatcher._listing(directory)[1]
+                else:
+                    names = (name,)
+                for entry_name in names:
+                    if entry_name in ignored[directory]:
+                        continue
+                    if not entry_name.lower().endswith(PARTIAL_SUFFIXES):
+                        pending[directory, entry_name] = (None, now)
+
+            ready = defaultdict(set)
+            for key, (signature, since) in list(pending.items()):
+                try:
+                    count_fs_call("stat")
+                    stat = os.stat(os.path.join(*key), follow_symlinks=False)
+                except OSError:
+                    del pending[key]  # Gone or renamed before it settled
+                    continue
+                current = (stat.st_size, stat.st_mtime_ns)
+                if current != signature:
+                    pending[key] = (current, now)
+                elif now - since >= settle:
+                    del pending[key]
+                    ready[key[0]].add(key[1])
+
+            for directory, names in ready.items():
+                # A directory removed or renamed meanwhile, or any other
+                # failure, is logged and the other directories keep being
+                # watched
+                try:
+                    plan = build_plan(
+                        directory, extensions[directory], only=names, **plan_options
+                    )
+                    if dedup is not None:
+                        plan, report = dedup_plan(plan, dedup)
+                        if dedup == "hardlink":
+                            link_duplicates(report)
+                    count, _ = execute_plan(plan, workers)
+                except Exception as e:
+                    log_message("error", f"Watch: sorting {directory} failed: {e}")
+                    continue
+                moved[directory] += count
+                log_message("info", f"Watch: sorted {count} new entries in {directory}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return moved
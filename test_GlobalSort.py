@@ -1,12 +1,109 @@
+import os
+import threading
+import time
 import unittest
 import shutil
+import subprocess
+import sys
+import tempfile
+import io
+import json
+import logging
+from contextlib import redirect_stderr, redirect_stdout
 from pathlib import Path
-from src.utils import sort_files
+from src.utils import (
+    sort_directory,
+    build_plan,
+    execute_plan,
+    export_plan,
+    load_plan,
+    get_folder_category,
+    MovePlan,
+)
+from src.shared import fs_calls, undo_stack
+from src.records import MoveRecords, PlanMoves, PlannedMove
+from src import mover, utils, instrument, logger, report, cache as folder_cache
+from src import pipeline
+from src.cli import run_cli
+from src.classifier import ExtensionClassifier
+from src import sniffer
+from src.dedup import dedup_plan, find_duplicates
+from src.collisions import numbered_name
+from src import watcher
+from src.watcher import watch_directories
+from src.pipeline import sort_targets, sort_all
+from src.progress import SortProgress
+from src import index as sort_index
+from src.deepsort import deep_sort
+from src.journal import UndoJournal
+from src.undo import undo_all_operations, undo_latest_session, _conflict_free_batches
 from src.language import os_language
 
+# Files the modules keep under User_Files, redirected to a temporary
+# directory for the whole suite: (module, attribute, name)
+USER_FILES = (
+    (report, "RUN_REPORT_FILE", "sort_runs.jsonl"),
+    (undo_stack, "path", "undo_journal.jsonl"),
+    (logger, "LOG_FILE", "file_sorter.log"),
+    (logger, "LOG_JSON_FILE", "file_sorter.jsonl"),
+    (utils, "LOG_FILE", "file_sorter.log"),
+    (sort_index, "SORT_INDEX_FILE", "sort_index.sqlite3"),
+    (folder_cache, "FOLDER_CACHE_FILE", "folder_cache.json"),
+)
+saved_user_files = []
 
-class TestSortFiles(unittest.TestCase):
+
+def setUpModule():
+    user_files = tempfile.mkdtemp(prefix="globalsort_test_")
+    saved_user_files.append(user_files)
+    for module, attribute, name in USER_FILES:
+        saved_user_files.append(getattr(module, attribute))
+        setattr(module, attribute, os.path.join(user_files, name))
+
+
+def tearDownModule():
+    logger.stop_logging()
+    reset_sort_state()
+    user_files, *saved = saved_user_files
+    for (module, attribute, _), value in zip(USER_FILES, saved):
+        setattr(module, attribute, value)
+    saved_user_files.clear()
+    shutil.rmtree(user_files)
+
+
+def reset_sort_state():
+    # Forget the directories sorted by earlier tests
+    if sort_index._sort_index is not None:
+        sort_index._sort_index.close()
+        sort_index._sort_index = None
+    folder_cache._folder_cache = None
+    for path in (sort_index.SORT_INDEX_FILE, folder_cache.FOLDER_CACHE_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class SortTestCase(unittest.TestCase):
+    # Each test starts with an empty sort index and folder cache
+    def setUp(self):
+        reset_sort_state()
+
+
+def order_plan(plan):
+    # The order execute_plan moves a plan in: files before folders, grouped
+    # by target directory, small entries first
+    return sorted(
+        plan.moves,
+        key=lambda move: (
+            move.kind == "folder",
+            os.path.dirname(move.destination),
+            move.size,
+        ),
+    )
+
+
+class TestSortFiles(SortTestCase):
     def setUp(self):
+        super().setUp()
         # Create a temporary directory for testing
         self.test_dir = Path("test_dir")
         self.test_dir.mkdir(exist_ok=True)
@@ -26,7 +123,7 @@ class TestSortFiles(unittest.TestCase):
 
     def test_sort_files_existing_extension(self):
         # Call the function with the test directory and extension map
-        sort_files(self.test_dir, self.extensions, True, True)
+        sort_directory(self.test_dir, self.extensions, incremental=False)
 
         # Check that the file has been moved to the correct directory
         self.assertTrue(
@@ -40,7 +137,7 @@ class TestSortFiles(unittest.TestCase):
 
     def test_sort_files_non_existing_extension(self):
         # Call the function with the test directory and extension map
-        sort_files(self.test_dir, self.extensions, True, True)
+        sort_directory(self.test_dir, self.extensions, incremental=False)
 
         # Check that the file has been moved to the 'Divers' directory
         self.assertFalse(
@@ -53,18 +150,20 @@ class TestSortFiles(unittest.TestCase):
         )
 
     def test_sort_files_no_create_dir(self):
-        # Call the function with the test directory and extension map, but with create_dir set to False
-        sort_files(self.test_dir, self.extensions, False, False)
+        # Only plan the moves: no folder is created and nothing is moved
+        plan = build_plan(self.test_dir, self.extensions, use_folder_cache=False)
 
+        self.assertEqual(len(plan.moves), 2)
         # Check that the file has not been moved
         self.assertTrue(
             self.test_file_txt.exists(),
-            "File was moved despite create_dir being False",
+            "File was moved by planning alone",
         )
         self.assertTrue(
             self.test_file_mp3.exists(),
-            "File was moved despite create_dir being False",
+            "File was moved by planning alone",
         )
+        self.assertFalse((self.test_dir / "Music").exists())
 
     def test_sort_files_empty_directory(self):
         # Create an empty directory for this test
@@ -72,7 +171,7 @@ class TestSortFiles(unittest.TestCase):
         empty_dir.mkdir()
 
         # Call the function with the empty directory and extension map
-        sort_files(empty_dir, self.extensions, True, True)
+        sort_directory(empty_dir, self.extensions, incremental=False)
 
         # Check that no new directories have been created
         self.assertEqual(
@@ -101,14 +200,895 @@ class TestSortFiles(unittest.TestCase):
         non_existent_dir = self.test_dir / "non_existent_dir"
 
         # Call the function with the non-existent directory and check the return value
-        sorted_flag, sorted_folders = sort_files(
-            non_existent_dir, self.extensions, True, True
-        )
+        sorted_flag, sorted_folders = sort_directory(non_existent_dir, self.extensions)
 
         # Assert that sorted_flag is False and sorted_folders is an empty set
         self.assertFalse(sorted_flag)
         self.assertEqual(sorted_folders, set())
 
 
+class TestSortDirectory(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_sort")
+        self.test_dir.mkdir(exist_ok=True)
+        (self.test_dir / "song.mp3").touch()
+        (self.test_dir / "notes.txt").touch()
+        (self.test_dir / "album").mkdir()
+        (self.test_dir / "album" / "track.mp3").touch()
+        self.extensions = {".txt": "Text Files", ".mp3": "Music"}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        undo_stack.clear()
+
+    def test_sort_directory_single_scan(self):
+        sorted_flag, sorted_folders = sort_directory(self.test_dir, self.extensions)
+
+        self.assertTrue(sorted_flag)
+        self.assertTrue((self.test_dir / "Music" / "song.mp3").exists())
+        self.assertTrue((self.test_dir / "Text Files" / "notes.txt").exists())
+        self.assertTrue((self.test_dir / "Music" / "album" / "track.mp3").exists())
+        self.assertEqual(
+            sorted_folders,
+            {str(self.test_dir / "Music"), str(self.test_dir / "Text Files")},
+        )
+        # One listing of the directory and one mkdir per category
+        self.assertEqual(fs_calls["mkdir"], 2)
+        self.assertEqual(fs_calls["rename"], 3)
+
+    def test_sort_directory_reports_each_run(self):
+        saved = report.RUN_REPORT_FILE
+        report.RUN_REPORT_FILE = "test_runs.jsonl"
+        try:
+            first = sort_directory(self.test_dir, self.extensions, dedup="skip")
+            (self.test_dir / "Music" / "old.mp3").write_text("tune")
+            (self.test_dir / "new.mp3").write_text("tune")
+            second = sort_directory(self.test_dir, self.extensions, dedup="skip")
+            records = [
+                json.loads(line)
+                for line in Path(report.RUN_REPORT_FILE).read_text().splitlines()
+            ]
+        finally:
+            Path(report.RUN_REPORT_FILE).unlink(missing_ok=True)
+            report.RUN_REPORT_FILE = saved
+
+        self.assertTrue(first[0])
+        self.assertFalse(second[0])  # Only a duplicate arrived, next to the folders
+        self.assertEqual(
+            [(r["scanned"], r["moved"], r["skipped"], r["failed"]) for r in records],
+            [(3, 3, 0, 0), (3, 0, 3, 0)],
+        )
+        self.assertEqual(records[0]["categories"], {"Music": 2, "Text Files": 1})
+
+    def test_sort_directory_parallel_records_every_move(self):
+        for i in range(20):
+            (self.test_dir / f"extra_{i:02}.txt").touch()
+        plan = build_plan(self.test_dir, self.extensions, use_folder_cache=False)
+        expected = [Path(move.source).name for move in order_plan(plan)]
+
+        sort_directory(self.test_dir, self.extensions, workers=4)
+
+        # Files complete in any order, but all of them before the folders
+        recorded = [src.name for src, _ in undo_stack]
+        self.assertEqual(sorted(recorded[:-1]), sorted(expected[:-1]))
+        self.assertEqual(recorded[-1], "album")
+        self.assertEqual(len(list((self.test_dir / "Text Files").iterdir())), 21)
+
+    def test_parallel_moves_are_queued_a_few_at_a_time(self):
+        pulled, results = [], {}
+
+        def items():
+            for i in range(100):
+                pulled.append(i)
+                yield i
+
+        for position, result in utils._bounded_map(lambda i: i * 2, items(), 2):
+            results[position] = result
+            self.assertLessEqual(
+                len(pulled) - len(results), 2 * utils.MOVES_IN_FLIGHT_PER_WORKER
+            )
+        self.assertEqual(results, {i: i * 2 for i in range(100)})
+
+    def test_undo_restores_the_tree_and_removes_empty_folders(self):
+        before = sorted(p.relative_to(self.test_dir) for p in self.test_dir.rglob("*"))
+        sort_directory(self.test_dir, self.extensions, use_folder_cache=False)
+
+        with redirect_stdout(io.StringIO()):
+            undone = undo_all_operations(workers=4)
+
+        self.assertEqual(undone, 3)
+        self.assertEqual(
+            sorted(p.relative_to(self.test_dir) for p in self.test_dir.rglob("*")),
+            before,
+        )
+
+    def test_undo_keeps_failed_moves_for_a_retry(self):
+        sort_directory(self.test_dir, self.extensions, use_folder_cache=False)
+        (self.test_dir / "album").write_text("in the way")
+
+        with redirect_stdout(io.StringIO()):
+            first = undo_latest_session()
+            (self.test_dir / "album").unlink()
+            second = undo_latest_session()
+
+        self.assertEqual((first["undone"], first["failed"]), (2, 1))
+        self.assertEqual((second["undone"], second["failed"]), (1, 0))
+        self.assertTrue((self.test_dir / "album" / "track.mp3").exists())
+        self.assertEqual(len(undo_stack), 0)
+
+    def test_undo_batches_never_share_paths(self):
+        records = [
+            (0, "s", Path("dir/Music/a.mp3"), Path("dir/sub/a.mp3")),
+            (0, "s", Path("dir/Music/b.mp3"), Path("dir/b.mp3")),
+            (0, "s", Path("dir/Music/sub"), Path("dir/sub")),
+        ]
+        batches = list(_conflict_free_batches(records))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+
+    def test_plan_is_built_without_touching_disk(self):
+        plan = build_plan(self.test_dir, self.extensions, use_folder_cache=False)
+
+        self.assertFalse((self.test_dir / "Music").exists())
+        self.assertEqual(
+            sorted(
+                (Path(move.destination).parent.name, move.kind) for move in plan.moves
+            ),
+            [("Music", "file"), ("Music", "folder"), ("Text Files", "file")],
+        )
+
+        plan_file = Path("test_plan.jsonl")
+        try:
+            export_plan(plan, plan_file)
+            moved, _ = execute_plan(load_plan(plan_file))
+        finally:
+            plan_file.unlink()
+        self.assertEqual(moved, 3)
+        self.assertTrue((self.test_dir / "Music" / "album" / "track.mp3").exists())
+
+    def test_cli_sort_prints_a_json_summary(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            code = run_cli(["sort", str(self.test_dir), "-e", "music", "--no-cache"])
+
+        summary = json.loads(output.getvalue())
+        self.assertEqual(code, 0)
+        self.assertEqual(summary["moved"], 3)
+        self.assertTrue((self.test_dir / "Musique" / "song.mp3").exists())
+
+    def test_cli_stats_counts_the_files_of_a_sorted_directory(self):
+        (self.test_dir / "song.mp3").write_text("song")
+        sort_directory(self.test_dir, self.extensions, incremental=False)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            run_cli(["stats", str(self.test_dir), "-e", "music"])
+
+        categories = json.loads(output.getvalue())["results"][0]["categories"]
+        self.assertEqual(categories["Musique"], {"files": 2, "bytes": 4})
+        self.assertEqual(categories["Divers"], {"files": 1, "bytes": 0})
+
+
+class TestPipeline(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_pipeline")
+        self.extensions = {".mp3": "Music", ".txt": "Text Files"}
+        for name in ("one", "two", "one/nested"):
+            directory = self.test_dir / name
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / "song.mp3").write_text("song")
+            (directory / "notes.txt").write_text("notes")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        undo_stack.clear()
+
+    def test_targets_are_sorted_concurrently_in_order(self):
+        targets = [
+            (self.test_dir / name, self.extensions)
+            for name in ("one/nested", "two", "missing", "one", "two")
+        ]
+        results = sort_targets(targets, concurrency=2, use_folder_cache=False)
+
+        self.assertEqual(
+            [result["directory"] for result in results],
+            [str(directory) for directory, _ in targets[:4]],
+        )
+        self.assertEqual([result.get("moved") for result in results], [2, 2, None, 3])
+        self.assertEqual(results[2]["error"], "directory does not exist")
+        # The nested target was sorted before its parent moved it away
+        self.assertTrue(
+            (self.test_dir / "one" / "Music" / "nested" / "Music" / "song.mp3").exists()
+        )
+
+    def test_sort_all_returns_one_consolidated_result(self):
+        targets = [
+            (self.test_dir / name, self.extensions) for name in ("one", "two", "gone")
+        ]
+        report = sort_all(targets, per_device=1, use_folder_cache=False)
+
+        self.assertEqual(report["directories"], 3)
+        self.assertEqual(report["devices"], 1)
+        self.assertEqual(report["moved"], 5)
+        self.assertEqual(
+            report["errors"], {str(self.test_dir / "gone"): "directory does not exist"}
+        )
+        self.assertIn(str(self.test_dir / "two" / "Music"), report["sorted_folders"])
+
+    def test_moves_share_the_device_limit(self):
+        for i in range(20):
+            (self.test_dir / "two" / f"extra_{i:02}.txt").write_text("extra")
+        lock, running, peak = threading.Lock(), [0], [0]
+        original = utils.fast_move
+
+        def tracked_move(source, destination):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.001)
+            try:
+                return original(source, destination)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        utils.fast_move = tracked_move
+        try:
+            report = sort_all(
+                [(self.test_dir / name, self.extensions) for name in ("one", "two")],
+                per_device=1,
+                workers=8,
+                incremental=False,
+                use_folder_cache=False,
+            )
+        finally:
+            utils.fast_move = original
+
+        self.assertEqual(report["moved"], 25)
+        self.assertEqual(peak[0], 1)
+
+    def test_cli_workers_raise_the_default_device_limit(self):
+        original, threads = pipeline.execute_plan, []
+
+        def recording_execute(plan, workers, **options):
+            threads.append(workers)
+            return original(plan, workers, **options)
+
+        pipeline.execute_plan = recording_execute
+        try:
+            with redirect_stdout(io.StringIO()):
+                run_cli(["sort", str(self.test_dir / "two"), "-w", "4", "--no-cache"])
+        finally:
+            pipeline.execute_plan = original
+
+        self.assertEqual(threads, [4])
+
+    def test_progress_counts_bytes_categories_and_phases(self):
+        stream = io.StringIO()
+        progress = SortProgress("Sorting", json_lines=True, interval=0, stream=stream)
+        results = sort_targets(
+            [(self.test_dir / "two", self.extensions)],
+            progress=progress,
+            incremental=False,
+            use_folder_cache=False,
+        )
+        progress.close()
+
+        self.assertEqual(results[0]["bytes"], len("song") + len("notes"))
+        self.assertEqual(results[0]["categories"], {"Music": 1, "Text Files": 1})
+        self.assertEqual(set(results[0]["phases"]), {"scan", "classify", "move"})
+        last = json.loads(stream.getvalue().splitlines()[-1])
+        self.assertEqual((last["files"], last["total"]), (2, 2))
+        self.assertEqual(last["bytes"], 9)
+
+
+class TestInstrument(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_instrument")
+        self.test_dir.mkdir(exist_ok=True)
+        (self.test_dir / "song.mp3").write_text("song")
+        self.saved = instrument.PROFILE_DIR
+        instrument.PROFILE_DIR = str(self.test_dir / "reports")
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.PROFILE_DIR = self.saved
+        shutil.rmtree(self.test_dir)
+        undo_stack.clear()
+
+    def test_timers_wrap_the_functions_only_while_enabled(self):
+        original = utils.scan_directory
+        instrument.enable(["timers"])
+        self.assertIsNot(utils.scan_directory, original)
+        # Only the modules of the package are patched, not this one
+        self.assertIsNot(utils.sort_directory, sort_directory)
+        utils.sort_directory(self.test_dir, {".mp3": "Music"}, incremental=False)
+        reports = instrument.disable()
+
+        self.assertIs(utils.scan_directory, original)
+        self.assertEqual(instrument.timings["utils.scan_directory"][0], 1)
+        self.assertEqual(instrument.timings["mover.fast_move"][0], 1)
+        self.assertIn("phase move", instrument.timings)
+        self.assertEqual(len(reports), 1)
+        self.assertIn("utils.sort_directory", Path(reports[0]).read_text())
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path("test_dir_logger")
+        self.test_dir.mkdir(exist_ok=True)
+        logger.stop_logging()  # Started by the CLI tests
+
+    def tearDown(self):
+        logger.stop_logging()
+        shutil.rmtree(self.test_dir)
+
+    def test_records_are_written_as_json_lines_and_rotated(self):
+        path = self.test_dir / "sorter.jsonl"
+        logger.setup_logging("json", str(path), max_bytes=2000, backups=1)
+        for i in range(100):
+            logger.log_message("info", f"moved file_{i}")
+        logger.stop_logging()
+
+        self.assertLessEqual(path.stat().st_size, 2000)
+        self.assertTrue(Path(f"{path}.1").exists())
+        self.assertFalse(Path(f"{path}.2").exists())
+        last = json.loads(path.read_text().splitlines()[-1])
+        self.assertEqual((last["level"], last["message"]), ("info", "moved file_99"))
+
+    def test_rotation_does_not_flush_every_record(self):
+        path = self.test_dir / "sorter.log"
+        writes = []
+
+        class CountingFile(io.FileIO):
+            def write(self, data):
+                writes.append(len(data))
+                return super().write(data)
+
+        def counting_open(file, mode, encoding=None, errors=None):
+            buffered = io.BufferedWriter(CountingFile(file, mode))
+            return io.TextIOWrapper(buffered, encoding=encoding, errors=errors)
+
+        handler = logger.BufferedRotatingFileHandler(
+            str(path), maxBytes=4000, backupCount=1, encoding="utf-8", delay=True
+        )
+        handler._builtin_open = counting_open
+        for i in range(1000):
+            handler.emit(logging.makeLogRecord({"msg": f"moved file_{i}"}))
+        handler.close()
+
+        # About 15 kB over 4 kB files: a handful of writes, not one per record
+        self.assertLess(len(writes), 20)
+        self.assertLessEqual(path.stat().st_size, 4000)
+        self.assertTrue(Path(f"{path}.1").exists())
+        self.assertEqual(path.read_text().splitlines()[-1], "moved file_999")
+
+
+class TestMoveRecords(unittest.TestCase):
+    def test_records_give_back_the_planned_moves(self):
+        root = os.path.join("home", "Downloads")
+        moves = [
+            PlannedMove(
+                os.path.join(root, "b.mp3"),
+                os.path.join(root, "Music", "b (1).mp3"),
+                30,
+                "Music",
+                "file",
+            ),
+            PlannedMove(
+                os.path.join(root, "album"),
+                os.path.join(root, "Music", "album"),
+                0,
+                "Music",
+                "folder",
+            ),
+            PlannedMove(
+                os.path.join(root, "deep", "a.txt"),
+                os.path.join(root, "Text Files", "a.txt"),
+                10,
+                "Text Files",
+                "file",
+            ),
+        ]
+        records = MoveRecords(moves)
+
+        self.assertEqual(list(records), moves)
+        self.assertEqual(records[-1], moves[-1])
+        self.assertEqual(records.destination(0), moves[0].destination)
+        self.assertFalse(hasattr(records, "append"))  # Plans are read-only
+        plan = MovePlan(root, root, records)
+        self.assertEqual([records[i] for i in records.ordered()], order_plan(plan))
+        triples = PlanMoves(records, records.ordered(), root, "/origin")
+        self.assertEqual(triples[0][2], os.path.join("/origin", "b.mp3"))
+        self.assertEqual(triples[1][2], os.path.join("/origin", "deep", "a.txt"))
+
+
+class TestSortIndex(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_index")
+        (self.test_dir / "album").mkdir(parents=True, exist_ok=True)
+        (self.test_dir / "album" / "track.mp3").write_text("track")
+        (self.test_dir / "song.mp3").write_text("song")
+        self.extensions = {".mp3": "Music"}
+        self.saved = sort_index._sort_index, sort_index.SORT_INDEX_RACY_SECONDS
+        sort_index._sort_index = sort_index.SortIndex("test_sort_index.db")
+        sort_index.SORT_INDEX_RACY_SECONDS = 0
+
+    def tearDown(self):
+        sort_index._sort_index.close()
+        sort_index._sort_index, sort_index.SORT_INDEX_RACY_SECONDS = self.saved
+        os.remove("test_sort_index.db")
+        shutil.rmtree(self.test_dir)
+        undo_stack.clear()
+
+    def test_only_new_entries_are_processed(self):
+        sort_directory(self.test_dir, self.extensions, use_folder_cache=False)
+        self.assertTrue((self.test_dir / "Music" / "album" / "track.mp3").exists())
+
+        # Nothing arrived: one stat of the directory, no listing
+        sort_directory(self.test_dir, self.extensions, use_folder_cache=False)
+        self.assertEqual(fs_calls["scandir"], 0)
+        self.assertEqual(fs_calls["stat"], 1)
+
+        (self.test_dir / "new.mp3").write_text("new")
+        sort_directory(self.test_dir, self.extensions, use_folder_cache=False)
+        self.assertTrue((self.test_dir / "Music" / "new.mp3").exists())
+        # The settled Music folder is not walked again to be classified:
+        # listings of the directory, of Music for collisions, and the record
+        self.assertEqual(fs_calls["scandir"], 3)
+
+
+class TestDeepSort(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_deep")
+        for path, text in (
+            ("mixed/a.mp3", "a"),
+            ("mixed/b.txt", "b"),
+            ("mixed/inner/c.mp3", "c"),
+            ("mixed/inner/deeper/d.mp3", "d"),
+            ("other/a.mp3", "other a"),
+        ):
+            (self.test_dir / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.test_dir / path).write_text(text)
+        self.extensions = {".mp3": "Music", ".txt": "Text Files"}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        undo_stack.clear()
+
+    def test_subtrees_are_flattened_down_to_max_depth(self):
+        moved, _ = deep_sort(self.test_dir, self.extensions, max_depth=2, processes=2)
+
+        self.assertEqual(moved, 4)
+        music = self.test_dir / "Music"
+        self.assertEqual((music / "a.mp3").read_text(), "a")
+        self.assertEqual((music / "a (1).mp3").read_text(), "other a")
+        self.assertTrue((music / "c.mp3").exists())
+        self.assertTrue((self.test_dir / "Text Files" / "b.txt").exists())
+        # Too deep: left where it was, with the folders holding it
+        self.assertTrue((self.test_dir / "mixed/inner/deeper/d.mp3").exists())
+        self.assertFalse((self.test_dir / "other").exists())
+
+    def test_duplicates_are_skipped_in_deep_mode(self):
+        (self.test_dir / "other" / "copy.mp3").write_text("c")
+        moved, _ = deep_sort(self.test_dir, self.extensions, dedup="skip", processes=1)
+
+        self.assertEqual(moved, 4)
+        self.assertTrue((self.test_dir / "other" / "copy.mp3").exists())
+
+    def test_cli_deep_sort_takes_the_directory_after_the_flag(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            code = run_cli(
+                [
+                    "sort",
+                    "--deep",
+                    "--depth",
+                    "3",
+                    "--processes",
+                    "1",
+                    str(self.test_dir),
+                ]
+            )
+
+        self.assertEqual(code, 0)
+        self.assertEqual(json.loads(output.getvalue())["moved"], 5)
+        self.assertTrue((self.test_dir / "Musique" / "d.mp3").exists())
+
+    def test_folder_budgets_are_rejected_in_deep_mode(self):
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            run_cli(["sort", str(self.test_dir), "--deep", "--max-files", "10"])
+        self.assertTrue((self.test_dir / "mixed" / "a.mp3").exists())
+
+
+class TestFolderCategory(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_category")
+        (self.test_dir / "deep" / "deeper").mkdir(parents=True)
+        for i in range(3):
+            (self.test_dir / f"doc_{i}.txt").touch()
+        for i in range(5):
+            (self.test_dir / "deep" / "deeper" / f"song_{i}.mp3").touch()
+        (self.test_dir / "deep" / "song.mp3").touch()
+        self.extensions = {".txt": "Text Files", ".mp3": "Music"}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_unlimited_budget_counts_everything(self):
+        self.assertEqual(get_folder_category(self.test_dir, self.extensions), "Music")
+
+    def test_max_depth_limits_the_walk(self):
+        self.assertEqual(
+            get_folder_category(self.test_dir, self.extensions, max_depth=0),
+            "Text Files",
+        )
+
+    def test_max_files_limits_the_walk(self):
+        self.assertEqual(
+            get_folder_category(self.test_dir, self.extensions, max_files=3),
+            "Text Files",
+        )
+
+    def test_cache_skips_unchanged_folders(self):
+        cache = folder_cache.FolderCategoryCache(
+            str(self.test_dir.with_suffix(".json"))
+        )
+        racy_seconds = folder_cache.FOLDER_CACHE_RACY_SECONDS
+        folder_cache.FOLDER_CACHE_RACY_SECONDS = 0
+        try:
+            get_folder_category(self.test_dir, self.extensions, cache=cache)
+            self.assertEqual(
+                get_folder_category(self.test_dir, self.extensions, cache=cache),
+                "Music",
+            )
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # A new file changes the mtime of its directory
+            for i in range(10):
+                (self.test_dir / "deep" / f"doc_{i}.txt").touch()
+            self.assertEqual(
+                get_folder_category(self.test_dir, self.extensions, cache=cache),
+                "Text Files",
+            )
+            self.assertEqual(cache.misses, 2)
+        finally:
+            folder_cache.FOLDER_CACHE_RACY_SECONDS = racy_seconds
+            Path(cache.path).unlink(missing_ok=True)
+
+    def test_unknown_files_fall_back_to_divers(self):
+        self.assertEqual(get_folder_category(self.test_dir, {".pdf": "Docs"}), "Divers")
+
+
+class TestExtensionClassifier(unittest.TestCase):
+    def setUp(self):
+        self.classifier = ExtensionClassifier(
+            {".gz": "Archives", ".TAR.GZ": "Backups", "jpg": "Images"},
+            rules=[("*.part", "Partial"), ("re:^scan_\\d+$", "Scans")],
+        )
+
+    def test_longest_compound_suffix_wins(self):
+        self.assertEqual(self.classifier.classify("site.tar.gz"), "Backups")
+        self.assertEqual(self.classifier.classify("log.gz"), "Archives")
+        self.assertEqual(self.classifier.classify("photo.2024.JPG"), "Images")
+
+    def test_names_without_extension(self):
+        self.assertEqual(self.classifier.classify(".gz"), "Divers")
+        self.assertEqual(self.classifier.classify("README"), "Divers")
+
+    def test_rules_and_reverse_index(self):
+        self.assertEqual(self.classifier.classify("video.mp4.part"), "Partial")
+        self.assertEqual(self.classifier.classify("SCAN_0042"), "Scans")
+        self.assertEqual(self.classifier.extensions_of("Backups"), (".tar.gz",))
+
+
+class TestSniffer(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_sniffer")
+        self.test_dir.mkdir(exist_ok=True)
+        (self.test_dir / "download").write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(64))
+        (self.test_dir / "report.crdownload").write_bytes(b"%PDF-1.7\n")
+        (self.test_dir / "blob").write_bytes(bytes(range(256)))
+        self.saved_sniffer = sniffer._sniffer
+        sniffer._sniffer = sniffer.Sniffer(str(self.test_dir / "sniff_cache.json"))
+
+    def tearDown(self):
+        sniffer._sniffer = self.saved_sniffer
+        shutil.rmtree(self.test_dir)
+
+    def test_plan_classifies_unknown_files_by_content(self):
+        extensions = {".png": "Images", ".pdf": "Documents"}
+        plan = build_plan(self.test_dir, extensions, use_folder_cache=False)
+        self.assertEqual({move.category for move in plan.moves}, {"Divers"})
+
+        plan = build_plan(self.test_dir, extensions, use_folder_cache=False, sniff=True)
+        categories = {Path(move.source).name: move.category for move in plan.moves}
+        self.assertEqual(categories["download"], "Images")
+        self.assertEqual(categories["report.crdownload"], "Documents")
+        self.assertEqual(categories["blob"], "Divers")
+
+    def test_results_are_cached_until_the_file_changes(self):
+        path = self.test_dir / "download"
+        self.assertEqual(sniffer._sniffer.sniff(path), ".png")
+        sniffer._sniffer.save()
+
+        cached = sniffer.Sniffer(str(self.test_dir / "sniff_cache.json"))
+        fs_calls.clear()
+        self.assertEqual(cached.sniff(path), ".png")
+        self.assertEqual(fs_calls["read"], 0)
+
+        path.write_bytes(b"ID3" + bytes(64))
+        self.assertEqual(cached.sniff(path), ".mp3")
+
+
+class TestDedup(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_dedup")
+        (self.test_dir / "Images").mkdir(parents=True, exist_ok=True)
+        (self.test_dir / "Images" / "sorted.jpg").write_bytes(b"old photo")
+        (self.test_dir / "copy.jpg").write_bytes(b"old photo")
+        (self.test_dir / "a.jpg").write_bytes(b"new photo")
+        (self.test_dir / "b.jpg").write_bytes(b"new photo")
+        (self.test_dir / "c.jpg").write_bytes(b"new image")
+        self.extensions = {".jpg": "Images"}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        undo_stack.clear()
+
+    def test_large_files_differing_in_the_middle_are_not_duplicates(self):
+        block = bytes(range(256)) * 1024
+        first = self.test_dir / "first.bin"
+        second = self.test_dir / "second.bin"
+        first.write_bytes(block + b"a" + block)
+        second.write_bytes(block + b"b" + block)
+        third = self.test_dir / "third.bin"
+        shutil.copy(first, third)
+        files = [(str(path), path.stat().st_size) for path in (first, second, third)]
+
+        groups, _ = find_duplicates(files)
+        self.assertEqual(groups, [[str(first), str(third)]])
+
+    def test_skip_leaves_duplicates_in_place(self):
+        sort_directory(self.test_dir, self.extensions, dedup="skip")
+
+        # One of the two new copies is kept, whichever was planned first
+        left = sorted(path.name for path in self.test_dir.glob("*.jpg"))
+        self.assertIn(left, (["a.jpg", "copy.jpg"], ["b.jpg", "copy.jpg"]))
+        self.assertTrue((self.test_dir / "Images" / "c.jpg").exists())
+
+    def test_quarantine_and_hardlink_policies(self):
+        plan = build_plan(self.test_dir, self.extensions, use_folder_cache=False)
+        quarantined, report = dedup_plan(plan, "quarantine")
+        self.assertEqual(report.bytes_saved, 18)
+        self.assertEqual(
+            sum(move.category == "Doublons" for move in quarantined.moves), 2
+        )
+
+        sort_directory(self.test_dir, self.extensions, dedup="hardlink")
+        self.assertEqual(
+            (self.test_dir / "Images" / "copy.jpg").stat().st_ino,
+            (self.test_dir / "Images" / "sorted.jpg").stat().st_ino,
+        )
+
+
+class TestCollisions(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_collisions")
+        (self.test_dir / "Images").mkdir(parents=True, exist_ok=True)
+        self.sorted_file = self.test_dir / "Images" / "a.jpg"
+        self.sorted_file.write_text("sorted")
+        (self.test_dir / "a.jpg").write_text("new")
+        (self.test_dir / "a (1).jpg").write_text("other")
+        self.extensions = {".jpg": "Images"}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def destinations(self, policy):
+        plan = build_plan(
+            self.test_dir, self.extensions, use_folder_cache=False, collisions=policy
+        )
+        return {
+            Path(move.source).name: Path(move.destination).name for move in plan.moves
+        }
+
+    def test_numbered_names(self):
+        self.assertEqual(numbered_name("photo.jpg", 2), "photo (2).jpg")
+        self.assertEqual(numbered_name("site.tar.gz", 1), "site (1).tar.gz")
+        self.assertEqual(numbered_name(".bashrc", 1), ".bashrc (1)")
+
+    def test_rename_is_deterministic(self):
+        fs_calls.clear()
+        self.assertEqual(
+            self.destinations("rename"),
+            {"a.jpg": "a (2).jpg", "a (1).jpg": "a (1).jpg"},
+        )
+        # The source directory, the walk of Images to classify it as a
+        # folder, and one listing of Images for the names already taken
+        self.assertEqual(fs_calls["scandir"], 3)
+
+    def test_skip_and_overwrite_newer(self):
+        self.assertEqual(self.destinations("skip"), {"a (1).jpg": "a (1).jpg"})
+        os.utime(self.sorted_file, (0, 0))
+        self.assertEqual(
+            self.destinations("overwrite-newer"),
+            {"a.jpg": "a.jpg", "a (1).jpg": "a (1).jpg"},
+        )
+
+
+class TestWatch(SortTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = Path("test_dir_watch")
+        self.test_dir.mkdir(exist_ok=True)
+        (self.test_dir / "already_there.jpg").write_text("old")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        undo_stack.clear()
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def watch(self, polling, before=None):
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=watch_directories,
+            args=([(self.test_dir, {".jpg": "Images"})],),
+            kwargs={"settle": 0.2, "interval": 0.05, "polling": polling, "stop": stop},
+        )
+        thread.start()
+        try:
+            time.sleep(0.2)
+            if before is not None:
+                (self.test_dir / "lost.jpg").write_text("lost")
+                before()
+            (self.test_dir / "photo.jpg.part").write_text("downloading")
+            (self.test_dir / "photo.jpg.part").rename(self.test_dir / "photo.jpg")
+            moved = self.test_dir / "Images" / "photo.jpg"
+            self.wait_for(moved.exists)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertTrue(moved.exists())
+        # Only new arrivals are sorted
+        self.assertTrue((self.test_dir / "already_there.jpg").exists())
+
+    def test_new_files_are_sorted_with_inotify(self):
+        self.watch(polling=False)
+
+    def test_new_files_are_sorted_when_polling(self):
+        self.watch(polling=True)
+
+    def test_a_failed_directory_does_not_stop_the_watch(self):
+        calls = []
+
+        def build_plan(directory, *args, **kwargs):
+            calls.append(directory)
+            if len(calls) == 1:
+                raise FileNotFoundError(directory)  # Removed while settling
+            return utils.build_plan(directory, *args, **kwargs)
+
+        watcher.build_plan = build_plan
+        try:
+            self.watch(polling=True, before=lambda: self.wait_for(lambda: calls))
+        finally:
+            watcher.build_plan = utils.build_plan
+        self.assertEqual(len(calls), 2)
+
+
+class TestMover(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path("test_dir_mover")
+        self.test_dir.mkdir(exist_ok=True)
+        self.source = self.test_dir / "big.bin"
+        self.source.write_bytes(bytes(range(256)) * 4096)
+        mover.clear_device_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_fast_move_renames_on_same_device(self):
+        destination = self.test_dir / "moved.bin"
+        mover.fast_move(self.source, destination)
+
+        self.assertFalse(self.source.exists())
+        self.assertEqual(destination.stat().st_size, 256 * 4096)
+
+    def test_move_file_is_journaled_for_undo(self):
+        undo_stack.clear()
+        utils.move_file(self.source, self.test_dir / "Divers")
+
+        self.assertTrue((self.test_dir / "Divers" / "big.bin").exists())
+        self.assertEqual(undo_all_operations(), 1)
+        self.assertTrue(self.source.exists())
+
+    def test_cross_device_copy_streams_large_files(self):
+        destination = self.test_dir / "copied.bin"
+        data = self.source.read_bytes()
+        old_threshold = mover.LARGE_FILE_THRESHOLD
+        mover.LARGE_FILE_THRESHOLD = 1
+        try:
+            mover._copy_and_delete(str(self.source), str(destination))
+        finally:
+            mover.LARGE_FILE_THRESHOLD = old_threshold
+
+        self.assertFalse(self.source.exists())
+        self.assertEqual(destination.read_bytes(), data)
+
+
+class TestUndoJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = "test_undo_journal.jsonl"
+
+    def tearDown(self):
+        Path(self.path).unlink(missing_ok=True)
+
+    def test_sessions_are_read_back_newest_first(self):
+        first = UndoJournal(self.path, sync_every=2)
+        for i in range(3):
+            first.append((Path(f"sorted/{i}"), Path(f"original/{i}")))
+        second = UndoJournal(self.path)
+        second.session = first.session + "-next"
+        second.append((Path("sorted/x"), Path("original/x")))
+
+        self.assertEqual(second.latest_session(), second.session)
+        self.assertEqual(second.pop(), (Path("sorted/x"), Path("original/x")))
+        # The next run sees the moves of the previous session
+        self.assertEqual(second.latest_session(), first.session)
+        self.assertEqual(
+            [str(moved_to) for _, _, moved_to, _ in second.iter_reverse(first.session)],
+            ["sorted/2", "sorted/1", "sorted/0"],
+        )
+        second.drop_session(first.session)
+        self.assertFalse(second)
+
+    def test_retention_drops_the_oldest_sessions(self):
+        for i in range(4):
+            journal = UndoJournal(self.path, max_sessions=2)
+            journal.session = f"session-{i}"
+            journal.append((Path("a"), Path("b")))
+        sessions = {session for _, session, _, _ in journal.iter_reverse()}
+        self.assertEqual(sessions, {"session-2", "session-3"})
+
+
+class TestStartup(unittest.TestCase):
+    # Run in a fresh interpreter: this one has imported everything already
+    def run_python(self, code):
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        return result.stdout.splitlines()[-1]
+
+    def test_importing_the_languages_builds_no_menu(self):
+        built = self.run_python(
+            "from src import language\n"
+            "print(dict.__len__(language.LANGUAGE_FUNCTIONS))"
+        )
+        self.assertEqual(built, "0")
+
+    def test_help_imports_none_of_the_sorting_modules(self):
+        modules = self.run_python(
+            "import runpy, sys\n"
+            "sys.argv = ['GlobalSort.py', '--help']\n"
+            "try:\n"
+            "    runpy.run_path('GlobalSort.py', run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    print(sorted(sys.modules))"
+        )
+        for module in ("asyncio", "sqlite3", "src.logger", "src.instrument"):
+            self.assertNotIn(f"'{module}'", modules)
+
+
 if __name__ == "__main__":
     unittest.main()